@@ -1,35 +1,161 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
-import tempfile
+import asyncio
+import json
 import os
+import time
+from contextlib import asynccontextmanager
 
-from app.services.llm_extraction import llm_extract
-from app.services.ocr_service import ocr_and_structure
-from app.schema.Response import Response
+from typing import List
 
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
-app = FastAPI(title="Invoice Extraction PoC")
+from app.services import executor, ocr_pool, openrouter
+from app.services.cache import result_cache
+from app.services.phash import phash_index
+from app.services.executor import run_blocking
+from app.services.lazy import preload
+from app.services.document import MAX_UPLOAD_BYTES, UPLOAD_FORM_OVERHEAD, RequestSizeLimit, read_upload
+from app.services.jobs import (
+    BATCH_MAX_BYTES, JOB_CONCURRENCY, JOB_MAX_CONCURRENCY, get_job_queue, get_job_runner, read_batch, stream_results,
+)
+from app.services.metrics import REGISTRY, SIZE_BUCKETS, gauge, histogram
+from app.services.pipeline import MODES, extract_document, extract_document_stream
+from app.services.timing import server_timing, start_request
+
+
+# Import heavy modules, start OCR workers and open the upstream client at startup; /ready reports 503 until done
+APP_PREWARM = os.getenv("APP_PREWARM", "0") == "1"
+
+
+async def prewarm(ready: asyncio.Event) -> None:
+    try:
+        await asyncio.gather(run_blocking(preload), ocr_pool.warm())
+        openrouter.get_client()
+    finally:
+        # A failed warm-up only means the first requests pay for it; don't keep the replica out
+        ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = asyncio.Event()
+    if APP_PREWARM:
+        # In the background, so the server starts accepting (and health-checking) immediately
+        app.state.prewarm = asyncio.create_task(prewarm(app.state.ready))
+    else:
+        app.state.ready.set()
+    get_job_runner().start()
+    yield
+    await get_job_runner().stop()
+    await openrouter.aclose()
+    executor.shutdown()
+    ocr_pool.shutdown()
+
+
+app = FastAPI(title="Invoice Extraction PoC", lifespan=lifespan)
+
+upload_bytes = histogram("extract_upload_bytes", "Size of uploaded documents", ("mode",), SIZE_BUCKETS)
+in_flight = gauge("extract_in_flight", "Extraction requests being processed")
+
+
+def max_request_bytes(path: str) -> int:
+    return (BATCH_MAX_BYTES if path == "/extract/batch" else MAX_UPLOAD_BYTES) + UPLOAD_FORM_OVERHEAD
+
+
+app.add_middleware(RequestSizeLimit, max_bytes=max_request_bytes)
+
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """Report per-stage durations of the request in a Server-Timing header."""
+    timings = start_request()
+    start = time.perf_counter()
+    response = await call_next(request)
+    timings["total"] = time.perf_counter() - start
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
 
 
 @app.post("/extract")
 async def extract_invoice(file: UploadFile = File(...), mode: str = Form("llm"), model_ocr: str = Form("google/gemini-2.5-flash"), model_llm: str = Form("google/gemini-2.5-flash")):
-    # Save temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-
+    if mode not in MODES:
+        return JSONResponse(content={"error": "Invalid mode"}, status_code=400)
+    doc = await read_upload(file)
+    upload_bytes.observe(len(doc.data), mode=mode)
+    in_flight.inc()
     try:
-        if mode == "ocr":
-            result, usage = ocr_and_structure(tmp_path, model_ocr)
-            return Response(structured_data= result, model=model_ocr, method='ocr', usage=usage)
-        elif mode == "llm":
-            result, usage = llm_extract(tmp_path, model_llm)
-            return Response(structured_data= result, model=model_llm, method='llm', usage=usage)
-        elif mode == "both":
-            text, usage_ocr = ocr_and_structure(tmp_path, model_ocr)
-            result, usage_llm = llm_extract(tmp_path, model_llm)
-            return {'OCR': Response(structured_data=text, model=model_ocr, method='ocr', usage=usage_ocr), 'LLM': Response(structured_data=result, model=model_llm, method='llm', usage=usage_llm)}
-        else:
-            return JSONResponse(content={"error": "Invalid mode"}, status_code=400)
+        return await extract_document(doc, mode, model_ocr, model_llm)
     finally:
-        os.remove(tmp_path)
+        in_flight.dec()
+
+
+@app.post("/extract/stream")
+async def extract_invoice_stream(request: Request, file: UploadFile = File(...), mode: str = Form("llm"), model_ocr: str = Form("google/gemini-2.5-flash"), model_llm: str = Form("google/gemini-2.5-flash")):
+    """Like /extract, but streams each field as it is produced: NDJSON, or SSE when the client accepts text/event-stream."""
+    if mode not in MODES:
+        return JSONResponse(content={"error": "Invalid mode"}, status_code=400)
+    doc = await read_upload(file)
+    upload_bytes.observe(len(doc.data), mode=mode)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def body():
+        in_flight.inc()
+        try:
+            async for event in extract_document_stream(doc, mode, model_ocr, model_llm):
+                if sse:
+                    yield f"event: {event.pop('event')}\ndata: {json.dumps(event)}\n\n"
+                else:
+                    yield json.dumps(event) + "\n"
+        finally:
+            in_flight.dec()
+
+    return StreamingResponse(body(), media_type="text/event-stream" if sse else "application/x-ndjson")
+
+
+@app.post("/extract/batch", status_code=202)
+async def extract_batch(files: List[UploadFile] = File(...), mode: str = Form("llm"), model_ocr: str = Form("google/gemini-2.5-flash"), model_llm: str = Form("google/gemini-2.5-flash"), concurrency: int = Form(JOB_CONCURRENCY)):
+    if mode not in MODES:
+        return JSONResponse(content={"error": "Invalid mode"}, status_code=400)
+    docs = await read_batch(files)
+    if not docs:
+        return JSONResponse(content={"error": "No documents in upload"}, status_code=400)
+
+    concurrency = max(1, min(concurrency, JOB_MAX_CONCURRENCY))
+    job_id = await run_blocking(get_job_queue().create_job, docs, mode, model_ocr, model_llm, concurrency)
+    get_job_runner().notify()
+    return {"job_id": job_id, "total": len(docs)}
+
+
+@app.get("/jobs/{job_id}")
+async def job_progress(job_id: str):
+    progress = await run_blocking(get_job_queue().progress, job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return progress
+
+
+@app.get("/jobs/{job_id}/results")
+async def job_results(job_id: str):
+    queue = get_job_queue()
+    if await run_blocking(queue.progress, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(stream_results(queue, job_id), media_type="application/x-ndjson")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = result_cache.stats()
+    stats["near_duplicates"] = phash_index.stats() if phash_index is not None else None
+    return stats
+
+
+@app.get("/ready")
+async def ready():
+    if not app.state.ready.is_set():
+        return JSONResponse(content={"ready": False}, status_code=503)
+    return {"ready": True}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -1,11 +1,38 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class LocationData(BaseModel):
+    City: Optional[str] = None
+    Country: Optional[str] = None
+
+
+class PartyData(BaseModel):
+    PartyName: Optional[str] = None
+    Role: Optional[str] = Field(None, description="e.g. Exporter, Consignee")
+    Location: Optional[LocationData] = None
+
+
+class CountryOverviewData(BaseModel):
+    CountryOfOrigin: Optional[str] = Field(None, description="Only if explicitly stated")
+    CountryOfDestination: Optional[str] = Field(None, description="Only if explicitly stated")
+    TransitCountry: Optional[str] = Field(None, description="Only if explicitly stated")
+
+
+class CommodityData(BaseModel):
+    DescriptionOfGoods: Optional[str] = None
+    HSCode: Optional[str] = None
+
+
+class TransportationData(BaseModel):
+    MeansOfTransport: Optional[str] = None
+    VesselNumber: Optional[str] = None
+
 
 class InvoiceData(BaseModel):
-    consignor: str | None = None
-    consignee: str | None = None
-    country_of_origin: str | None = None
-    country_of_destination: str | None = None
-    hs_code: str | None = None
-    description_of_goods: str | None = None
-    means_of_transport: str | None = None
-    vessel: str | None = None
\ No newline at end of file
+    """The structure every extraction returns; prompts and the JSON schema are generated from it."""
+    Parties: List[PartyData] = []
+    CountryOverview: Optional[CountryOverviewData] = None
+    CommodityDetails: List[CommodityData] = []
+    Transportation: Optional[TransportationData] = None
@@ -0,0 +1,90 @@
+import functools
+import hashlib
+import json
+import os
+import typing
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.models.data import InvoiceData
+from app.prompt.prompt import prompt
+
+
+class PromptTemplate(NamedTuple):
+    version: str
+    text: str                               # fixed prefix, identical on every call
+    response_format: Optional[Dict] = None  # OpenAI-style structured output, if the variant uses it
+
+    def cache_id(self) -> str:
+        """Hash of everything that changes what the model is asked (part of the result cache key)."""
+        data = self.version + self.text + json.dumps(self.response_format, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def skeleton(model: type[BaseModel]) -> Dict:
+    """The model's fields as a JSON object with null leaves, lists holding one example item."""
+    out = {}
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        is_list = typing.get_origin(annotation) in (list, typing.List)
+        inner = [a for a in typing.get_args(annotation) if a is not type(None)] or [annotation]
+        item = inner[0]
+        value = skeleton(item) if isinstance(item, type) and issubclass(item, BaseModel) else None
+        out[name] = [value] if is_list else value
+    return out
+
+
+SECTION_INSTRUCTIONS = {
+    "Parties": "each party (name, role e.g. Exporter/Consignee, city, country)",
+    "CountryOverview": "country of origin, destination and transit, only if explicitly stated (never infer them "
+                       "from party locations)",
+    "CommodityDetails": "each commodity's description and HS code",
+    "Transportation": "means of transport and vessel number",
+}
+
+
+def instructions(sections) -> str:
+    return ("Extract from the document: " + "; ".join(SECTION_INSTRUCTIONS[s] for s in sections)
+            + ". Use null for anything missing. Reply with JSON only")
+
+
+INSTRUCTIONS = instructions(SECTION_INSTRUCTIONS)
+
+TEMPLATES: Dict[str, PromptTemplate] = {
+    # The original prompt, whitespace and all
+    "full": PromptTemplate("v1", prompt),
+    "minified": PromptTemplate(
+        "v2", INSTRUCTIONS + ", shaped like:" + json.dumps(skeleton(InvoiceData), separators=(",", ":")) + "\n"),
+    # Shape enforced by the provider through a JSON schema instead of spelled out in the prompt
+    "schema": PromptTemplate("v2", INSTRUCTIONS + ".\n", {
+        "type": "json_schema",
+        "json_schema": {"name": "invoice", "strict": False, "schema": InvoiceData.model_json_schema()},
+    }),
+}
+
+PROMPT_VARIANT = os.getenv("PROMPT_VARIANT", "full")
+# cache_control breakpoints on the fixed prefix for providers that need them to cache it
+# (OpenAI and DeepSeek cache long prefixes automatically)
+PROMPT_CACHE_HINTS = os.getenv("PROMPT_CACHE_HINTS", "1") == "1"
+CACHE_HINT_MODELS = ("anthropic/", "google/gemini")
+
+
+def get_template(variant: str | None = None) -> PromptTemplate:
+    return TEMPLATES[variant or PROMPT_VARIANT]
+
+
+@functools.lru_cache(maxsize=None)
+def partial_template(sections: Tuple[str, ...]) -> PromptTemplate:
+    """A minified template asking only for some top-level sections (the rest are known already)."""
+    shape = {name: value for name, value in skeleton(InvoiceData).items() if name in sections}
+    return PromptTemplate("v2", instructions(sections) + ", shaped like:" + json.dumps(shape, separators=(",", ":"))
+                          + "\n")
+
+
+def prompt_part(model: str, template: PromptTemplate) -> Dict:
+    """The template's fixed prefix as a message part, with a caching hint where the provider takes one."""
+    part = {"type": "text", "text": template.text}
+    if PROMPT_CACHE_HINTS and model.startswith(CACHE_HINT_MODELS):
+        part["cache_control"] = {"type": "ephemeral"}
+    return part
@@ -1,8 +1,10 @@
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, Optional
 
 class Response(BaseModel):
     structured_data: Dict
-    model: str = None
+    model: Optional[str] = None
     method: str
-    usage: dict = None
\ No newline at end of file
+    usage: Optional[dict] = None
+    timings: Optional[Dict[str, float]] = None  # stage durations in ms, when EXTRACT_RESPONSE_TIMINGS=1
+    cache: Optional[str] = None  # "miss", "off", or "hit" / "near" / "coalesced": no tokens spent for this request
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from app.prompt.templates import get_template
+from app.services.document import Document
+from app.services.image_prep import IMAGE_PREP_PROFILE
+from app.services.layouts import LAYOUTS_ID
+from app.services.metrics import counter
+from app.services.ocr_engine import OCR_PROFILE, engine_name
+from app.services.routing import cache_name
+from app.services.rules import RULES_EXTRACTION
+
+
+# Backend: "memory", "sqlite" or "none"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3")
+# How often the sqlite cache drops expired rows and recounts its size (other processes may share the file)
+RESULT_CACHE_SWEEP_SECONDS = float(os.getenv("RESULT_CACHE_SWEEP_SECONDS", "60"))
+
+PROMPT_HASH = get_template().cache_id()
+
+cache_lookups_total = counter("result_cache_lookups_total", "Result cache lookups", ("result",))
+cache_saved_tokens_total = counter("result_cache_saved_tokens_total", "Tokens not spent thanks to cache hits", ("kind",))
+
+
+def extraction_context(mode: str, model_ocr: str, model_llm: str) -> str:
+    """
+    Everything besides the document that determines an extraction: mode, model(s), prompt,
+    profiles, OCR engine, layouts, rules.
+    """
+    model_ocr, model_llm = cache_name(model_ocr), cache_name(model_llm)
+    models = {"ocr": model_ocr, "llm": model_llm, "both": f"{model_ocr}|{model_llm}"}.get(mode, "")
+    return (f"{mode}|{models}|{PROMPT_HASH}|{IMAGE_PREP_PROFILE}|{OCR_PROFILE}|{engine_name()}|{LAYOUTS_ID}"
+            f"|{RULES_EXTRACTION:d}")
+
+
+def cache_key(doc: Document, mode: str, model_ocr: str, model_llm: str) -> str:
+    """Content address of an extraction: document bytes plus its extraction context."""
+    key = f"{doc.sha256}|{extraction_context(mode, model_ocr, model_llm)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class CacheBackend(ABC):
+    """Key/value store for serialized results. Implementations must be thread-safe."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU with TTL, bounded by entry count and total value size."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value, UTF-8 size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, _ = entry
+            if expires_at < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.time() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _pop(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SQLiteCache(CacheBackend):
+    """On-disk store that survives restarts; evicts least recently used rows past `max_bytes`."""
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl: float = RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)")
+        # Running total of `size`, so inserts need not sum the table
+        self._bytes = 0
+        self._next_sweep = 0.0
+        self._sweep(time.time())
+
+    def _sweep(self, now: float) -> None:
+        """Drop expired rows and recount the total size."""
+        self._conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self._next_sweep = now + RESULT_CACHE_SWEEP_SECONDS
+
+    def _delete(self, key: str) -> None:
+        row = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._bytes -= row[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._delete(key)
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl, now),
+            )
+            self._bytes += size
+            if now >= self._next_sweep:
+                self._sweep(now)
+            while self._bytes > self.max_bytes:
+                oldest = self._conn.execute("SELECT key FROM results ORDER BY accessed_at LIMIT 1").fetchone()
+                if oldest is None:
+                    break
+                self._delete(oldest[0])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._bytes = 0
+
+
+class ResultCache:
+    """Serializes extraction results into a backend and keeps hit/miss and saved-token counters."""
+
+    def __init__(self, backend: Optional[CacheBackend]):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str) -> Optional[Dict]:
+        if self.backend is None:
+            return None
+        raw = self.backend.get(key)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                cache_lookups_total.inc(result="miss")
+                return None
+            self.hits += 1
+            cache_lookups_total.inc(result="hit")
+            result = json.loads(raw)
+            for usage in _usages(result):
+                self.saved_prompt_tokens += usage.get("prompt_tokens") or 0
+                self.saved_completion_tokens += usage.get("completion_tokens") or 0
+                cache_saved_tokens_total.inc(usage.get("prompt_tokens") or 0, kind="prompt")
+                cache_saved_tokens_total.inc(usage.get("completion_tokens") or 0, kind="completion")
+            return result
+
+    def set(self, key: str, result: Dict) -> bool:
+        """Store a result; returns False if it was not cached (cache off, or an error result)."""
+        if self.backend is None or has_error(result):
+            return False
+        self.backend.set(key, json.dumps(result))
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__ if self.backend else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_prompt_tokens": self.saved_prompt_tokens,
+                "saved_completion_tokens": self.saved_completion_tokens,
+                "saved_total_tokens": self.saved_prompt_tokens + self.saved_completion_tokens,
+            }
+
+
+def _responses(result: Dict):
+    # A single Response dump, or {'OCR': ..., 'LLM': ...} in mode=both
+    return [result] if "structured_data" in result else list(result.values())
+
+
+def _usages(result: Dict):
+    return [r.get("usage") or {} for r in _responses(result)]
+
+
+def has_error(result: Dict) -> bool:
+    """Whether any branch of an extraction result reported an error."""
+    return any("error" in (r.get("structured_data") or {}) for r in _responses(result))
+
+
+def make_backend(name: str = RESULT_CACHE_BACKEND) -> Optional[CacheBackend]:
+    if name == "memory":
+        return MemoryCache()
+    elif name == "sqlite":
+        return SQLiteCache()
+    elif name == "none":
+        return None
+    raise ValueError(f"Unknown result cache backend: {name}")
+
+
+result_cache = ResultCache(make_backend())
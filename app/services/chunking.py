@@ -0,0 +1,102 @@
+import asyncio
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+# Long documents are split into overlapping page windows that are extracted concurrently
+LLM_PAGE_WINDOW = int(os.getenv("LLM_PAGE_WINDOW", "5"))
+LLM_PAGE_OVERLAP = int(os.getenv("LLM_PAGE_OVERLAP", "1"))
+LLM_MAX_PAGES = int(os.getenv("LLM_MAX_PAGES", "200"))
+
+# Fields that identify a list entry; entries agreeing on them are the same party / commodity
+IDENTITY_FIELDS = {
+    "Parties": ("PartyName", "Role"),
+    "CommodityDetails": ("DescriptionOfGoods", "HSCode"),
+}
+
+
+def page_windows(n: int, window: int = LLM_PAGE_WINDOW, overlap: int = LLM_PAGE_OVERLAP) -> List[List[int]]:
+    """Split pages 0..n-1 into windows of `window` pages, consecutive windows sharing `overlap` pages."""
+    window = max(1, window)
+    step = max(1, window - max(0, overlap))
+    windows = []
+    start = 0
+    while True:
+        windows.append(list(range(start, min(n, start + window))))
+        if start + window >= n:
+            return windows
+        start += step
+
+
+def window_note(pages: List[int], n: int) -> str:
+    """Prompt suffix telling the model which part of a longer document it is looking at."""
+    return (f"\nThis is pages {pages[0] + 1}-{pages[-1] + 1} of a {n}-page document. "
+            f"Extract only what appears on these pages; use null for anything not shown.\n")
+
+
+def _normalize(value: Any) -> str:
+    if value is None:
+        return ""
+    return re.sub(r"[\W_]+", " ", str(value)).strip().casefold()
+
+
+def _identity(field: str, item: Any) -> str:
+    names = IDENTITY_FIELDS.get(field)
+    if names and isinstance(item, dict) and any(item.get(name) for name in names):
+        return "|".join(_normalize(item.get(name)) for name in names)
+    return json.dumps(item, sort_keys=True, default=str).casefold()
+
+
+def merge_values(field: str, a: Any, b: Any) -> Any:
+    """Combine two windows' values for a field: lists are unioned, objects filled in, scalars kept."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, list) and isinstance(b, list):
+        merged: Dict[str, Any] = {}
+        for item in a + b:
+            key = _identity(field, item)
+            merged[key] = merge_values(field, merged[key], item) if key in merged else item
+        return list(merged.values())
+    if isinstance(a, dict) and isinstance(b, dict):
+        return {k: merge_values(k, a.get(k), b.get(k)) for k in {**a, **b}}
+    return a
+
+
+def merge_results(results: List[Dict]) -> Dict:
+    """Merge per-window extractions into one result, deduplicating parties and commodities."""
+    merged: Dict = {}
+    for result in results:
+        for field, value in result.items():
+            merged[field] = merge_values(field, merged.get(field), value)
+    return merged
+
+
+def merge_usage(usages: List[Dict]) -> Dict:
+    """Sum the token counts of several completions (labels such as the prompt variant are kept from the first)."""
+    total: Dict = {}
+    for usage in usages:
+        for key, value in usage.items():
+            if isinstance(value, (int, float)):
+                total[key] = total.get(key, 0) + value
+            elif isinstance(value, str):
+                total.setdefault(key, value)
+    return total
+
+
+async def extract_windows(windows: List[List[int]],
+                          extract: Callable[[List[int]], Awaitable[Tuple[Dict, Dict]]]) -> Tuple[Dict, Dict]:
+    """
+    Run `extract` on every page window concurrently and merge the results.
+    Any failing window fails the whole extraction, so partial results are never cached.
+    """
+    outcomes = await asyncio.gather(*(extract(pages) for pages in windows), return_exceptions=True)
+    for pages, outcome in zip(windows, outcomes):
+        if isinstance(outcome, BaseException):
+            raise RuntimeError(f"Pages {pages[0] + 1}-{pages[-1] + 1}: {outcome}") from outcome
+    usage = merge_usage([u for _, u in outcomes])
+    usage["windows"] = len(windows)
+    return merge_results([r for r, _ in outcomes]), usage
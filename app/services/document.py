@@ -0,0 +1,120 @@
+import hashlib
+import io
+import os
+import threading
+from functools import cached_property
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.formparsers import MultiPartParser
+
+from app.services.lazy import lazy_import
+
+fitz = lazy_import("fitz")  # PyMuPDF
+Image = lazy_import("PIL.Image")
+
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Allowance for multipart headers and form fields on top of the file itself
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Keep uploaded parts in memory up to the upload limit instead of spooling them to a temp file
+# past Starlette's 1 MB default: read_upload copies them into a buffer anyway
+MultiPartParser.spool_max_size = MAX_UPLOAD_BYTES
+
+# PyMuPDF is not thread-safe; hold this around fitz work done in the app process's threads
+FITZ_LOCK = threading.Lock()
+
+
+class Document:
+    """An uploaded document held in memory; services open it straight from the buffer."""
+
+    def __init__(self, data: bytes | bytearray, filename: str = ""):
+        self.data = data
+        self.filename = filename or ""
+
+    @classmethod
+    def from_path(cls, path: str) -> "Document":
+        with open(path, "rb") as f:
+            return cls(f.read(), os.path.basename(path))
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.filename.lower().endswith(".pdf") or bytes(self.data[:5]) == b"%PDF-"
+
+    @cached_property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    def open_pdf(self) -> "fitz.Document":
+        return fitz.open(stream=self.data, filetype="pdf")
+
+    def open_image(self) -> "Image.Image":
+        return Image.open(io.BytesIO(self.data))
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Document:
+    """Read an upload in chunks into a single buffer, rejecting it once it exceeds `max_bytes`."""
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+    buf = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buf += chunk
+        if len(buf) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+    return Document(buf, file.filename)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware that rejects request bodies over `max_bytes(path)` with 413: up front on
+    Content-Length, or as soon as a chunked body streams past the limit. Starlette has already
+    received the whole multipart body by the time an endpoint runs, so `read_upload`'s own check
+    cannot stop an oversized upload.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = self.max_bytes(scope["path"])
+        too_large = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            return await too_large(scope, receive, send)
+
+        received, started = 0, False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _BodyTooLarge
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # Whatever the app answers to the aborted body (FastAPI turns it into a 400), send the 413 instead
+            if received > limit and not started:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if received > limit and not started:
+            await too_large(scope, receive, send)
@@ -0,0 +1,228 @@
+import base64
+import io
+import math
+import os
+import threading
+from typing import Dict, NamedTuple, Tuple
+
+from app.services.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageChops = lazy_import("PIL.ImageChops")
+ImageOps = lazy_import("PIL.ImageOps")
+ImageStat = lazy_import("PIL.ImageStat")
+
+
+class ImageProfile(NamedTuple):
+    grayscale: str = "off"      # "off", "on" or "auto" (only for monochrome scans)
+    crop_margins: bool = False  # trim uniform whitespace around the content
+    max_edge: int | None = 2000  # None: use the model's own effective long edge
+    format: str = "jpeg"        # "jpeg", "webp", "png" or "auto" (by content)
+    quality: int = 80
+
+
+PROFILES: Dict[str, ImageProfile] = {
+    # What the service always sent before: fit in 2000x2000, JPEG q80
+    "baseline": ImageProfile(),
+    "compact": ImageProfile(grayscale="auto", crop_margins=True, max_edge=None, format="auto", quality=75),
+    "gray": ImageProfile(grayscale="on", crop_margins=True, max_edge=None, format="jpeg", quality=75),
+}
+
+IMAGE_PREP_PROFILE = os.getenv("IMAGE_PREP_PROFILE", "baseline")
+# Also encode the baseline image to report real bytes saved (costs one extra encode per page)
+IMAGE_PREP_MEASURE = os.getenv("IMAGE_PREP_MEASURE", "0") == "1"
+
+# Providers downscale larger images anyway; anything above this long edge costs bytes, not accuracy
+MODEL_MAX_EDGE = {
+    "openai/": 1536,
+    "anthropic/": 1568,
+    "google/": 1536,
+    "meta-llama/": 1120,
+    "qwen/": 1536,
+}
+DEFAULT_MAX_EDGE = 1600
+
+MONO_THRESHOLD = 6.0  # mean channel spread below which a page is treated as monochrome
+MARGIN_THRESHOLD = 245  # luminance above which a pixel counts as background
+MARGIN_PADDING = 16
+
+
+class PreparedImage(NamedTuple):
+    data_url: str
+    width: int
+    height: int
+    bytes: int
+    est_tokens: int
+    baseline_tokens: int
+    baseline_bytes: int | None = None
+
+
+def model_max_edge(model: str) -> int:
+    for prefix, edge in MODEL_MAX_EDGE.items():
+        if model.startswith(prefix):
+            return edge
+    return DEFAULT_MAX_EDGE
+
+
+def estimate_image_tokens(model: str, width: int, height: int) -> int:
+    """Rough prompt-token cost of one image, following each provider's published tiling rules."""
+    if model.startswith("openai/"):
+        # Fit in 2048x2048, shortest side to 768, then 170 tokens per 512px tile + 85
+        scale = min(1.0, 2048 / max(width, height))
+        w, h = width * scale, height * scale
+        scale = min(1.0, 768 / min(w, h))
+        w, h = w * scale, h * scale
+        return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+    if model.startswith("google/"):
+        # 258 tokens for small images, otherwise per 768x768 tile
+        if width <= 384 and height <= 384:
+            return 258
+        return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+    # Anthropic and most others: about one token per 750 pixels
+    return math.ceil(width * height / 750)
+
+
+def is_monochrome(img: "Image.Image") -> bool:
+    if img.mode in ("1", "L", "LA"):
+        return True
+    small = img.convert("RGB").resize((64, 64))
+    r, g, b = small.split()
+    spread = ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b))
+    return ImageStat.Stat(spread).mean[0] < MONO_THRESHOLD
+
+
+def crop_margins(img: "Image.Image") -> "Image.Image":
+    """Trim near-white margins, keeping a small padding around the content."""
+    gray = img.convert("L")
+    mask = gray.point(lambda v: 255 if v < MARGIN_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(0, left - MARGIN_PADDING),
+        max(0, top - MARGIN_PADDING),
+        min(img.width, right + MARGIN_PADDING),
+        min(img.height, bottom + MARGIN_PADDING),
+    ))
+
+
+def _choose_format(img: "Image.Image", profile: ImageProfile) -> str:
+    if profile.format != "auto":
+        return profile.format
+    # Few distinct colours (born-digital pages): lossless palette PNG keeps text crisp and small
+    if img.resize((256, 256)).getcolors(maxcolors=64) is not None:
+        return "png"
+    return "webp"
+
+
+def _encode(img: "Image.Image", fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png":
+        if img.mode not in ("L", "P"):
+            img = img.convert("P", palette=Image.ADAPTIVE, colors=64)
+        img.save(buf, format="PNG", optimize=True)
+    elif fmt == "webp":
+        img.save(buf, format="WEBP", quality=quality, method=4)
+    else:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def _baseline_size(img: "Image.Image", scale: float) -> Tuple[int, int]:
+    """Size the legacy encoding would have sent: `scale` applied, then fit in 2000x2000."""
+    w, h = img.width * scale, img.height * scale
+    fit = min(1.0, 2000 / max(w, h))
+    return max(1, round(w * fit)), max(1, round(h * fit))
+
+
+def prepare_image(img: "Image.Image", model: str, profile_name: str | None = None, scale: float = 1.0) -> PreparedImage:
+    """
+    Apply an image profile to a page image and encode it as a data URL.
+    `scale` is an extra downscale applied first (e.g. 300 -> 200 DPI for rendered pages).
+    """
+    profile = PROFILES[profile_name or IMAGE_PREP_PROFILE]
+    baseline_size = _baseline_size(img, scale)
+    baseline_tokens = estimate_image_tokens(model, *baseline_size)
+    baseline_bytes = None
+    if IMAGE_PREP_MEASURE:
+        baseline_bytes = len(_encode(img.resize(baseline_size, Image.BILINEAR, reducing_gap=2.0), "jpeg", 80))
+
+    if profile.grayscale == "on" or (profile.grayscale == "auto" and is_monochrome(img)):
+        img = ImageOps.grayscale(img)
+    if profile.crop_margins:
+        img = crop_margins(img)
+
+    max_edge = profile.max_edge or model_max_edge(model)
+    scale = min(scale, max_edge / max(img.width, img.height))
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.BILINEAR, reducing_gap=2.0)
+
+    fmt = _choose_format(img, profile)
+    data = _encode(img, fmt, profile.quality)
+    b64 = base64.b64encode(data).decode("utf-8")
+    prepared = PreparedImage(
+        data_url=f"data:image/{fmt};base64,{b64}",
+        width=img.width,
+        height=img.height,
+        bytes=len(data),
+        est_tokens=estimate_image_tokens(model, img.width, img.height),
+        baseline_tokens=baseline_tokens,
+        baseline_bytes=baseline_bytes,
+    )
+    prep_stats.record(prepared)
+    return prepared
+
+
+class PrepStats:
+    """Running totals of what image preparation sent versus the baseline encoding."""
+
+    def __init__(self):
+        self.pages = 0
+        self.bytes = 0
+        self.est_tokens = 0
+        self.baseline_tokens = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, prepared: PreparedImage) -> None:
+        with self._lock:
+            self.pages += 1
+            self.bytes += prepared.bytes
+            self.est_tokens += prepared.est_tokens
+            self.baseline_tokens += prepared.baseline_tokens
+            if prepared.baseline_bytes is not None:
+                self.bytes_saved += prepared.baseline_bytes - prepared.bytes
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "bytes": self.bytes,
+                "bytes_saved": self.bytes_saved,
+                "est_tokens": self.est_tokens,
+                "est_tokens_saved": self.baseline_tokens - self.est_tokens,
+            }
+
+
+prep_stats = PrepStats()
+
+
+def summarize(prepared) -> Dict:
+    """Per-request report of the images sent: sizes and estimated token savings per page."""
+    pages = []
+    for p in prepared:
+        page = {"width": p.width, "height": p.height, "bytes": p.bytes,
+                "est_tokens": p.est_tokens, "est_tokens_saved": p.baseline_tokens - p.est_tokens}
+        if p.baseline_bytes is not None:
+            page["bytes_saved"] = p.baseline_bytes - p.bytes
+        pages.append(page)
+    return {
+        "pages": pages,
+        "bytes": sum(p.bytes for p in prepared),
+        "est_tokens": sum(p.est_tokens for p in prepared),
+        "est_tokens_saved": sum(p.baseline_tokens - p.est_tokens for p in prepared),
+    }
@@ -0,0 +1,287 @@
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from app.services.cache import has_error
+from app.services.document import MAX_UPLOAD_BYTES, Document, read_upload
+from app.services.executor import run_blocking
+from app.services.pipeline import extract_document
+
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+# Worker tasks shared by all jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Default and maximum number of documents of one job processed at once (bounds upstream calls per job)
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_MAX_CONCURRENCY = int(os.getenv("JOB_MAX_CONCURRENCY", "16"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Finished jobs and their results are deleted this long after they finish, checked every JOB_SWEEP_INTERVAL
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "3600"))
+# Limits on one batch after zip archives are expanded (the documents are held in memory, then in SQLite)
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(512 * 1024 * 1024)))
+
+SUPPORTED_SUFFIXES = (".pdf", ".png", ".jpg", ".jpeg")
+
+
+class JobQueue:
+    """SQLite-backed queue of batch extraction jobs, one row per document."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, mode TEXT NOT NULL, model_ocr TEXT NOT NULL, model_llm TEXT NOT NULL,
+                concurrency INTEGER NOT NULL, total INTEGER NOT NULL,
+                created_at REAL NOT NULL, finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                job_id TEXT NOT NULL, idx INTEGER NOT NULL, filename TEXT NOT NULL, data BLOB,
+                status TEXT NOT NULL, result TEXT, seq INTEGER, finished_at REAL,
+                PRIMARY KEY (job_id, idx)
+            );
+            CREATE INDEX IF NOT EXISTS items_status ON items (status, job_id);
+            CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+            """
+        )
+        # Items that were running when the process died go back to the queue
+        self._conn.execute("UPDATE items SET status = 'queued' WHERE status = 'running'")
+
+    def create_job(self, docs: List[Document], mode: str, model_ocr: str, model_llm: str,
+                   concurrency: int) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, mode, model_ocr, model_llm, concurrency, total, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, mode, model_ocr, model_llm, concurrency, len(docs), time.time()),
+            )
+            self._conn.executemany(
+                "INSERT INTO items (job_id, idx, filename, data, status) VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, i, doc.filename, bytes(doc.data)) for i, doc in enumerate(docs)],
+            )
+            self._conn.execute("COMMIT")
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, int, Document, str, str, str]]:
+        """Mark the oldest runnable item as running, honouring each job's concurrency limit."""
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT i.job_id, i.idx, i.filename, i.data, j.mode, j.model_ocr, j.model_llm
+                FROM items i JOIN jobs j ON j.id = i.job_id
+                WHERE i.status = 'queued'
+                  AND (SELECT COUNT(*) FROM items r WHERE r.job_id = i.job_id AND r.status = 'running') < j.concurrency
+                ORDER BY j.created_at, i.idx
+                LIMIT 1
+                """
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, idx, filename, data, mode, model_ocr, model_llm = row
+            self._conn.execute("UPDATE items SET status = 'running' WHERE job_id = ? AND idx = ?", (job_id, idx))
+            return job_id, idx, Document(data, filename), mode, model_ocr, model_llm
+
+    def complete(self, job_id: str, idx: int, result: Dict, failed: bool) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE items SET status = ?, result = ?, data = NULL, finished_at = ?,"
+                " seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM items WHERE job_id = ?)"
+                " WHERE job_id = ? AND idx = ?",
+                ("failed" if failed else "done", json.dumps(result), now, job_id, job_id, idx),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET finished_at = ? WHERE id = ? AND finished_at IS NULL AND NOT EXISTS"
+                " (SELECT 1 FROM items WHERE job_id = ? AND status IN ('queued', 'running'))",
+                (now, job_id, job_id),
+            )
+
+    def progress(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT mode, total, concurrency, created_at, finished_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        mode, total, concurrency, created_at, finished_at = job
+        if finished_at is not None:
+            status = "done"
+        elif counts.get("queued", 0) == total:
+            status = "queued"
+        else:
+            status = "running"
+        return {
+            "id": job_id,
+            "status": status,
+            "mode": mode,
+            "concurrency": concurrency,
+            "total": total,
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "created_at": created_at,
+            "finished_at": finished_at,
+        }
+
+    def purge_finished(self, before: float) -> int:
+        """Delete jobs that finished before `before`, with their items; returns how many were deleted."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "DELETE FROM items WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (before,)
+            )
+            deleted = self._conn.execute("DELETE FROM jobs WHERE finished_at < ?", (before,)).rowcount
+            self._conn.execute("COMMIT")
+        return deleted
+
+    def finished_items(self, job_id: str, after_seq: int) -> List[Tuple[int, str, str, str, int]]:
+        """Items finished after completion number `after_seq`, in completion order."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT idx, filename, status, result, seq FROM items"
+                " WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+
+
+class JobRunner:
+    """Pool of worker tasks that drain the job queue through the extraction pipeline."""
+
+    def __init__(self, queue: JobQueue, workers: int = JOB_WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _sweeper(self) -> None:
+        while True:
+            await run_blocking(self.queue.purge_finished, time.time() - JOB_RETENTION_SECONDS)
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+
+    async def _worker(self) -> None:
+        while True:
+            item = await run_blocking(self.queue.claim)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, idx, doc, mode, model_ocr, model_llm = item
+            try:
+                result = await extract_document(doc, mode, model_ocr, model_llm)
+                # The pipeline reports branch failures in the result rather than raising
+                failed = has_error(result)
+            except Exception as e:
+                result, failed = {"error": str(e)}, True
+            await run_blocking(self.queue.complete, job_id, idx, result, failed)
+            # A finished item may unblock another item of the same job
+            self.notify()
+
+
+def check_batch_size(documents: int, size: int) -> None:
+    if documents > BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_DOCUMENTS} documents")
+    if size > BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_BYTES} bytes")
+
+
+def unpack_zip(data: bytes, documents: int = 0, size: int = 0) -> List[Document]:
+    """
+    Expand a zip archive into documents, skipping unsupported entries. The archive's entries are
+    checked against the batch limits, on top of `documents` and `size` already in the batch,
+    before any is decompressed (reads stop at an entry's declared size, so it cannot lie).
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        entries = []
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or name.startswith(".") or not name.lower().endswith(SUPPORTED_SUFFIXES):
+                continue
+            if info.file_size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"{info.filename} exceeds {MAX_UPLOAD_BYTES} bytes")
+            entries.append((info, name))
+        check_batch_size(documents + len(entries), size + sum(info.file_size for info, _ in entries))
+        return [Document(archive.read(info), name) for info, name in entries]
+
+
+async def read_batch(files: List[UploadFile]) -> List[Document]:
+    docs, size = [], 0
+    for file in files:
+        doc = await read_upload(file)
+        if doc.filename.lower().endswith(".zip"):
+            docs.extend(await run_blocking(unpack_zip, doc.data, len(docs), size))
+        else:
+            docs.append(doc)
+        size = sum(len(d.data) for d in docs)
+        check_batch_size(len(docs), size)
+    return docs
+
+
+async def stream_results(queue: JobQueue, job_id: str):
+    """Yield NDJSON lines for finished items as they complete, until the job is done."""
+    progress = await run_blocking(queue.progress, job_id)
+    last = 0
+    while last < progress["total"]:
+        items = await run_blocking(queue.finished_items, job_id, last)
+        for idx, filename, status, result, seq in items:
+            last = seq
+            line = {"index": idx, "filename": filename, "status": status, "result": json.loads(result)}
+            yield json.dumps(line) + "\n"
+        if last < progress["total"]:
+            # The retention sweep may delete the job while a slow client is still reading it
+            if not items and await run_blocking(queue.progress, job_id) is None:
+                return
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+_queue: JobQueue | None = None
+_runner: JobRunner | None = None
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(get_job_queue())
+    return _runner
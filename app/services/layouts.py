@@ -0,0 +1,106 @@
+import hashlib
+import json
+import math
+import os
+from typing import List, NamedTuple, Optional, Tuple
+
+from app.services.lazy import lazy_import
+from app.services.metrics import counter
+from app.services.ocr_engine import recognize
+
+Image = lazy_import("PIL.Image")
+
+
+# JSON file of known invoice layouts (see bench/layout_templates.py); empty: always OCR full pages
+OCR_LAYOUTS_PATH = os.getenv("OCR_LAYOUTS_PATH", "")
+# Minimum correlation between a page's thumbnail signature and a layout's to treat it as that layout
+LAYOUT_MATCH_THRESHOLD = float(os.getenv("LAYOUT_MATCH_THRESHOLD", "0.9"))
+LAYOUT_ASPECT_TOLERANCE = 0.03
+SIGNATURE_SIZE = 32
+
+layout_matches_total = counter("ocr_layout_matches_total", "OCR'd pages by matched layout (\"none\": full page)",
+                               ("layout",))
+ocr_pixels_total = counter("ocr_pixels_total", "Page pixels passed to Tesseract vs. pixels on the page", ("kind",))
+
+
+class Layout(NamedTuple):
+    name: str
+    aspect: float                                       # page height / width
+    signature: List[float]                              # SIGNATURE_SIZE^2 ink levels of a typical first page
+    regions: List[Tuple[float, float, float, float]]    # (x0, y0, x1, y1) as fractions of the page
+
+    def boxes(self, width: int, height: int) -> List[Tuple[int, int, int, int]]:
+        return [(round(x0 * width), round(y0 * height), round(x1 * width), round(y1 * height))
+                for x0, y0, x1, y1 in self.regions]
+
+
+class PageText(NamedTuple):
+    text: str
+    layout: Optional[str]   # matched layout, None for full-page OCR
+    pixels: int             # pixels OCR'd
+    page_pixels: int
+
+
+def load_layouts(path: str = OCR_LAYOUTS_PATH) -> List[Layout]:
+    if not path:
+        return []
+    with open(path) as f:
+        return [Layout(d["name"], d["aspect"], d["signature"], [tuple(r) for r in d["regions"]])
+                for d in json.load(f)["layouts"]]
+
+
+LAYOUTS = load_layouts()
+# Part of the result cache key: other templates give other OCR text
+LAYOUTS_ID = hashlib.sha256(json.dumps(LAYOUTS).encode("utf-8")).hexdigest()[:16] if LAYOUTS else "none"
+
+
+def signature(img: "Image.Image") -> List[float]:
+    """Ink level of each cell of a SIGNATURE_SIZE grid: where text, lines and boxes sit, not what they say."""
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    img = img.reduce(max(1, min(img.width, img.height) // (SIGNATURE_SIZE * 8))).convert("L")
+    return [255 - v for v in img.resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BOX).getdata()]
+
+
+def correlation(a: List[float], b: List[float]) -> float:
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    da = [x - mean_a for x in a]
+    db = [y - mean_b for y in b]
+    norm = math.sqrt(sum(x * x for x in da) * sum(y * y for y in db))
+    return sum(x * y for x, y in zip(da, db)) / norm if norm else 0.0
+
+
+def match_layout(img: "Image.Image", layouts: List[Layout] = LAYOUTS) -> Optional[Layout]:
+    """The best-matching known layout for a page image, or None if no layout is close enough."""
+    if not layouts:
+        return None
+    aspect = img.height / img.width
+    candidates = [layout for layout in layouts if abs(aspect / layout.aspect - 1) <= LAYOUT_ASPECT_TOLERANCE]
+    if not candidates:
+        return None
+    sig = signature(img)
+    score, i = max((correlation(sig, layout.signature), i) for i, layout in enumerate(candidates))
+    return candidates[i] if score >= LAYOUT_MATCH_THRESHOLD else None
+
+
+def recognize_page(img: "Image.Image", profile: str | None = None, source_dpi: int | None = None,
+                   layouts: List[Layout] = LAYOUTS) -> PageText:
+    """OCR only the regions of a page's layout, or the whole page when it matches no known layout."""
+    page_pixels = img.width * img.height
+    layout = match_layout(img, layouts)
+    if layout is None:
+        return PageText(recognize(img, profile, source_dpi), None, page_pixels, page_pixels)
+    texts, pixels = [], 0
+    for box in layout.boxes(img.width, img.height):
+        region = img.crop(box)
+        pixels += region.width * region.height
+        texts.append(recognize(region, profile, source_dpi).strip())
+    return PageText("\n".join(texts), layout.name, pixels, page_pixels)
+
+
+def record(page: PageText) -> str:
+    """Count a page's layout match and OCR'd area (in the app process); returns its text."""
+    layout_matches_total.inc(layout=page.layout or "none")
+    ocr_pixels_total.inc(page.pixels, kind="ocr")
+    ocr_pixels_total.inc(page.page_pixels, kind="page")
+    return page.text
@@ -0,0 +1,36 @@
+import importlib
+import sys
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    """
+    Stand-in for a heavy module that is only imported on first attribute access,
+    so importing the app does not pay for PyMuPDF, Pillow or Tesseract up front.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module: ModuleType | None = None
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+# Modules deferred this way; `preload` imports them all (e.g. to warm a replica before traffic)
+LAZY_MODULES = ("fitz", "PIL.Image", "PIL.ImageChops", "PIL.ImageOps", "PIL.ImageStat", "pytesseract", "json_repair")
+
+
+def lazy_import(name: str) -> ModuleType:
+    """The module itself if it is already loaded, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def preload() -> None:
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
@@ -1,136 +1,129 @@
-import io
-import json
-import re
-from typing import Tuple, Dict
-
-import requests
-import base64
-import os
-import fitz
-from json_repair import repair_json
-from PIL import Image
-from openai import OpenAI
-from app.prompt.prompt import prompt
-
-
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
-
-
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ["OPENROUTER_API_KEY"],
-)
-
-def pdf_to_data_urls(pdf_path: str, max_pages: int = 5, dpi: int = 200) -> list:
-    """Convert up to `max_pages` of a PDF to base64 data URLs for OpenRouter."""
-    pdf_doc = fitz.open(pdf_path)
-    urls = []
-
-    for i, page in enumerate(pdf_doc):
-        if i >= max_pages:
-            break
-
-        # Render page to pixmap
-        pix = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-
-        # Downscale large pages
-        img.thumbnail((2000, 2000))
-
-        # Save to JPEG for compression
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=80)
-        b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-        urls.append(f"data:image/jpeg;base64,{b64}")
-
-    return urls
-
-def image_file_to_data_url(image_path: str) -> str:
-    """Convert an image file to a base64 data URL."""
-    with Image.open(image_path) as img:
-        img.thumbnail((2000, 2000))
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=80)
-        b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-        return f"data:image/jpeg;base64,{b64}"
-
-def parse_structured_data(data_str: str) -> dict:
-    """Extracts JSON from Markdown code block, repairs it if broken, and returns dict."""
-    # Remove markdown fences like ```json ... ```
-    cleaned = re.sub(r"^```json\s*|\s*```$", "", data_str.strip(), flags=re.MULTILINE)
-    cleaned = re.sub(r"^```\s*|\s*```$", "", cleaned.strip(), flags=re.MULTILINE)
-
-    # Try to repair JSON first
-    repaired = repair_json(cleaned)
-
-    try:
-        return json.loads(repaired)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Still invalid JSON after repair: {e}\nContent: {repaired}")
-
-def llm_extract(file_path: str, model: str = "google/gemini-2.5-flash") -> Tuple[Dict, Dict | None]:
+import time
+from typing import Any, Callable, List, Tuple, Dict
+
+from app.prompt.templates import PROMPT_VARIANT, PromptTemplate, get_template, prompt_part
+from app.services.chunking import LLM_MAX_PAGES, extract_windows, page_windows, window_note
+from app.services.document import Document
+from app.services.executor import run_blocking
+from app.services.image_prep import PreparedImage, prepare_image, summarize
+from app.services.metrics import SIZE_BUCKETS, counter, histogram
+from app.services.openrouter import chat_completion, run_sync, stream_chat_completion
+from app.services.parsing import IncrementalJSONParser, parse_structured_data
+from app.services.raster import count_pages, prepare_pages
+from app.services.routing import model_label
+from app.services.timing import stage
+
+
+llm_pages_total = counter("llm_pages_total", "Page images sent to vision models", ("model",))
+llm_image_bytes = histogram("llm_image_bytes", "Encoded image payload per vision request", ("model",), SIZE_BUCKETS)
+prompt_tokens_total = counter("llm_prompt_tokens_total", "Prompt tokens by prompt variant", ("variant", "model"))
+prompt_cached_tokens_total = counter("llm_prompt_cached_tokens_total",
+                                     "Prompt tokens read from the provider's prompt cache", ("variant", "model"))
+completion_seconds = histogram("llm_completion_seconds", "Structured completion latency by prompt variant",
+                               ("variant", "model"))
+
+# Called with each top-level field of the result as soon as the model has produced it
+FieldCallback = Callable[[str, Any], None]
+
+
+async def prepare_pdf_pages(doc: Document, model: str, max_pages: int = LLM_MAX_PAGES, dpi: int = 200,
+                            profile: str | None = None) -> List[PreparedImage]:
+    """Prepare up to `max_pages` of a PDF as image data URLs for OpenRouter."""
+    n = await run_blocking(count_pages, doc)
+    return await prepare_pages(doc, list(range(min(n, max_pages))), model, dpi=dpi, profile=profile)
+
+def prepare_image_file(doc: Document, model: str, profile: str | None = None) -> PreparedImage:
+    """Prepare an image file as a data URL for OpenRouter."""
+    with doc.open_image() as img:
+        return prepare_image(img, model, profile)
+
+async def complete_structured(model: str, content: List[Dict], on_field: FieldCallback | None = None,
+                              variant: str | None = None, template: PromptTemplate | None = None) -> Tuple[Dict, Dict]:
+    """
+    Run a chat completion of the prompt template `variant` (or an explicit `template`, reported
+    under `variant`) followed by `content`, and parse its JSON answer.
+    With `on_field` the completion is streamed and parsed incrementally, reporting each
+    top-level field as soon as it is complete.
+    """
+    template = template or get_template(variant)
+    variant = variant or PROMPT_VARIANT
+    # The template goes first so providers can cache it as a common prefix
+    content = [prompt_part(model, template)] + content
+    start = time.perf_counter()
+    if on_field is None:
+        message_content, usage = await chat_completion(model, content, template.response_format)
+        with stage("parse"):
+            parsed = parse_structured_data(message_content)
+    else:
+        parser = IncrementalJSONParser()
+        usage = {}
+        async for delta in stream_chat_completion(model, content, usage, template.response_format):
+            for key, value in parser.feed(delta):
+                on_field(key, value)
+        with stage("parse"):
+            parsed = parser.finish()
+        # Fields only recovered by repairing the full output
+        for key, value in parsed.items():
+            if key not in parser.fields:
+                on_field(key, value)
+
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    usage = {**usage, "cached_tokens": cached, "prompt_variant": f"{variant}@{template.version}"}
+    label = model_label(model)
+    completion_seconds.observe(time.perf_counter() - start, variant=variant, model=label)
+    prompt_tokens_total.inc(usage.get("prompt_tokens") or 0, variant=variant, model=label)
+    prompt_cached_tokens_total.inc(cached, variant=variant, model=label)
+    return parsed, usage
+
+async def complete_windows(model: str, n_pages: int, windows: List[List[int]],
+                           window_content: Callable[[List[int], str], List[Dict]],
+                           on_field: FieldCallback | None = None) -> Tuple[Dict, Dict]:
+    """
+    Structured completion over page windows. `window_content(pages, note)` builds the message
+    for one window. A single window is sent as is (and streamed with `on_field`); several run
+    concurrently and are merged, with the merged fields reported once at the end.
+    """
+    if len(windows) == 1:
+        return await complete_structured(model, window_content(windows[0], ""), on_field)
+
+    parsed, usage = await extract_windows(
+        windows, lambda pages: complete_structured(model, window_content(pages, window_note(pages, n_pages))))
+    if on_field is not None:
+        for key, value in parsed.items():
+            on_field(key, value)
+    return parsed, usage
+
+async def llm_extract_async(doc: Document, model: str = "google/gemini-2.5-flash",
+                            image_profile: str | None = None,
+                            on_field: FieldCallback | None = None) -> Tuple[Dict, Dict | None]:
     """
     Extract structured fields from a document using OpenRouter-compatible LLMs.
     Also returns token usage if available.
+    Rendering runs in the bounded executor; the upstream call is non-blocking.
     """
-    if file_path.lower().endswith(".pdf"):
-        image_urls = pdf_to_data_urls(file_path, max_pages=5)
+    if doc.is_pdf:
+        images = await prepare_pdf_pages(doc, model, profile=image_profile)
     else:
-        image_urls = [image_file_to_data_url(file_path)]
-
-    content = [{"type": "text", "text": prompt}] + [
-        {"type": "image_url", "image_url": url} for url in image_urls
-    ]
-
-    # Decide method based on known OpenAI chat API compatibility
-    if any(keyword in model.lower() for keyword in ["gpt", "claude", "gemini", "llama", "mistral"]):
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": content}],
-            )
-            message_content = completion.choices[0].message.content
-            parsed_data = parse_structured_data(message_content)
-
-            # Include token usage if provided
-            usage_info = getattr(completion, "usage", None)
-            usage = {}
-            if usage_info:
-                usage = {
-                    "prompt_tokens": usage_info.prompt_tokens,
-                    "completion_tokens": usage_info.completion_tokens,
-                    "total_tokens": usage_info.total_tokens
-                }
-
-            return parsed_data, usage
-
-        except Exception as e:
-            return {"error": str(e)}, None
-
-    # Fallback: direct API request
-    else:
-        payload = {"model": model, "messages": [{"role": "user", "content": content}]}
-        headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
+        with stage("encode"):
+            images = [await run_blocking(prepare_image_file, doc, model, image_profile)]
 
-        resp = requests.post(f"{OPENROUTER_BASE_URL}/chat/completions", json=payload, headers=headers)
+    llm_pages_total.inc(len(images), model=model_label(model))
+    llm_image_bytes.observe(sum(image.bytes for image in images), model=model_label(model))
 
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError:
-            return {"error": f"{resp.status_code} - {resp.text}"}, None
+    def window_content(pages: List[int], note: str) -> List[Dict]:
+        return ([{"type": "text", "text": note}] if note else []) + [
+            {"type": "image_url", "image_url": images[i].data_url} for i in pages
+        ]
 
-        try:
-            resp_json = resp.json()
-            message_content = resp_json["choices"][0]["message"]["content"]
-            parsed_data = parse_structured_data(message_content)
+    try:
+        parsed_data, usage = await complete_windows(model, len(images), page_windows(len(images)), window_content, on_field)
+        return parsed_data, {**usage, "image_prep": summarize(images)}
 
-            # Include token usage if present
-            usage = {}
-            if "usage" in resp_json:
-                usage = resp_json["usage"]
+    except Exception as e:
+        return {"error": str(e)}, None
 
-            return parsed_data, usage
 
-        except Exception as e:
-            return {"error": str(e)}, None
+def llm_extract(file_path: str, model: str = "google/gemini-2.5-flash",
+                image_profile: str | None = None) -> Tuple[Dict, Dict | None]:
+    """Synchronous wrapper around `llm_extract_async`."""
+    return run_sync(llm_extract_async, Document.from_path(file_path), model=model, image_profile=image_profile)
@@ -0,0 +1,115 @@
+import functools
+import os
+import threading
+from typing import Dict, NamedTuple
+
+from app.services.lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
+pytesseract = lazy_import("pytesseract")
+
+
+class OcrProfile(NamedTuple):
+    dpi: int = 300              # pages are downscaled to this from the shared raster before OCR
+    psm: int = 3                # Tesseract page segmentation mode (3: fully automatic)
+    oem: int = 3                # OCR engine mode (1: LSTM only, 3: default)
+    lang: str = "eng"           # Tesseract language set, e.g. "eng+deu"
+    preprocess: str = "none"    # "none", "gray" or "binarize"
+
+
+PROFILES: Dict[str, OcrProfile] = {
+    # What the service always ran: 300 DPI colour page, Tesseract defaults
+    "baseline": OcrProfile(),
+    "gray": OcrProfile(preprocess="gray"),
+    # Invoices are mostly uniform blocks of text; LSTM only at 200 DPI is much faster
+    "fast": OcrProfile(dpi=200, psm=6, oem=1, preprocess="gray"),
+    "binarize": OcrProfile(preprocess="binarize"),
+}
+
+OCR_PROFILE = os.getenv("OCR_PROFILE", "baseline")
+# "auto" uses tesserocr (in-process, engine kept loaded) when it is installed, else pytesseract
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+
+
+@functools.lru_cache(maxsize=None)
+def _has_tesserocr() -> bool:
+    try:
+        import tesserocr  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def engine_name() -> str:
+    """The engine OCR_ENGINE resolves to in this environment: "tesserocr" or "pytesseract"."""
+    if OCR_ENGINE == "tesserocr" or (OCR_ENGINE == "auto" and _has_tesserocr()):
+        return "tesserocr"
+    return "pytesseract"
+
+
+# One loaded engine per (lang, psm, oem) per thread; TessBaseAPI objects are not thread-safe
+_engines = threading.local()
+
+
+def _tesserocr_api(profile: OcrProfile):
+    import tesserocr
+
+    apis = getattr(_engines, "apis", None)
+    if apis is None:
+        apis = _engines.apis = {}
+    key = (profile.lang, profile.psm, profile.oem)
+    if key not in apis:
+        apis[key] = tesserocr.PyTessBaseAPI(lang=profile.lang, psm=profile.psm, oem=profile.oem)
+    return apis[key]
+
+
+def otsu_threshold(img: "Image.Image") -> int:
+    """Grey level that best separates ink from paper (Otsu's method) for an 'L' image."""
+    hist = img.histogram()
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    weight_bg = sum_bg = 0
+    best, threshold = 0.0, 128
+    for level, count in enumerate(hist):
+        weight_bg += count
+        if weight_bg == 0 or weight_bg == total:
+            continue
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / (total - weight_bg)
+        between = weight_bg * (total - weight_bg) * (mean_bg - mean_fg) ** 2
+        if between > best:
+            best, threshold = between, level
+    return threshold
+
+
+def preprocess(img: "Image.Image", profile: OcrProfile, source_dpi: int | None = None) -> "Image.Image":
+    if source_dpi and profile.dpi < source_dpi:
+        scale = profile.dpi / source_dpi
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                         Image.BILINEAR, reducing_gap=2.0)
+    if profile.preprocess in ("gray", "binarize"):
+        img = ImageOps.grayscale(img)
+    if profile.preprocess == "binarize":
+        threshold = otsu_threshold(img)
+        img = img.point(lambda v: 255 if v > threshold else 0, mode="1")
+    return img
+
+
+def recognize(img: "Image.Image", profile_name: str | None = None, source_dpi: int | None = None) -> str:
+    """OCR an image with the given profile on the configured engine."""
+    profile = PROFILES[profile_name or OCR_PROFILE]
+    img = preprocess(img, profile, source_dpi)
+    if engine_name() == "tesserocr":
+        api = _tesserocr_api(profile)
+        api.SetImage(img)
+        return api.GetUTF8Text()
+    config = f"--psm {profile.psm} --oem {profile.oem}"
+    return pytesseract.image_to_string(img, lang=profile.lang, config=config)
+
+
+def warm_engine(profile_name: str | None = None) -> None:
+    """Load the in-process engine for a profile ahead of the first page (no-op without tesserocr)."""
+    if OCR_ENGINE != "pytesseract" and _has_tesserocr():
+        _tesserocr_api(PROFILES[profile_name or OCR_PROFILE])
@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List
+
+from app.services.layouts import PageText, record, recognize_page
+from app.services.lazy import preload
+from app.services.ocr_engine import warm_engine
+
+
+# Number of worker processes for page rendering and OCR
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_DPI = 300
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def make_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: forking a process that already runs threads (uvicorn, executor) is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = make_pool(OCR_WORKERS)
+    return _pool
+
+
+def warm_worker() -> None:
+    preload()
+    warm_engine()
+
+
+async def warm(workers: int = OCR_WORKERS) -> None:
+    """Start every worker process and have it load modules and its OCR engine before the first page arrives."""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(get_pool(), warm_worker) for _ in range(workers)))
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def ocr_raster(raster, profile: str | None = None) -> PageText:
+    """
+    OCR one rendered page (a raster.PageRaster) with an OCR profile, only its layout's regions
+    if it matches a known layout. Runs inside a worker process, which keeps its Tesseract
+    engine loaded between pages when tesserocr is installed.
+    """
+    try:
+        return recognize_page(raster.to_image(), profile, raster.dpi)
+    except Exception as e:
+        # Some pytesseract errors cannot be unpickled and would break the whole pool
+        raise RuntimeError(str(e)) from None
+
+
+def page_batches(n: int, workers: int) -> List[List[int]]:
+    """Stripe n pages across at most `workers` batches, so the document is shipped once per worker."""
+    return [list(range(k, n, workers)) for k in range(min(n, workers))]
+
+
+async def ocr_rasters(rasters, executor: Executor | None = None, profile: str | None = None) -> List[str]:
+    """OCR rendered pages in parallel across the process pool; returns texts in page order."""
+    executor = executor or get_pool()
+    loop = asyncio.get_running_loop()
+    pages = await asyncio.gather(*(loop.run_in_executor(executor, ocr_raster, r, profile) for r in rasters))
+    return [record(page) for page in pages]
@@ -1,35 +1,107 @@
 import os
-import re
-import json
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
-import requests
-from json_repair import repair_json
-from typing import Dict, Tuple
-from app.prompt.prompt import prompt
-
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-
-
-def ocr_extract(file_path: str) -> str:
+from typing import Dict, List, Optional, Tuple
+from app.prompt.templates import partial_template
+from app.services.document import FITZ_LOCK, Document
+from app.services.executor import run_blocking
+from app.services.layouts import record, recognize_page
+from app.services.chunking import page_windows
+from app.services.llm_extraction import FieldCallback, complete_structured, complete_windows
+from app.services.metrics import counter
+from app.services.openrouter import run_sync
+from app.services.raster import count_pages, iter_ocr
+from app.services.rules import RULES_EXTRACTION, SECTIONS, extract_rules, fill_hs_codes
+from app.services.timing import stage
+
+
+# Use a PDF's embedded text layer instead of OCR when a page has enough clean text
+OCR_TEXT_LAYER = os.getenv("OCR_TEXT_LAYER", "1") == "1"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+TEXT_LAYER_MIN_PRINTABLE = 0.9
+# Pages where images with no text over them cover this fraction of the page are OCR'd despite a
+# usable text layer: the images hold text the layer lacks (a scanned goods table, a stamped header)
+TEXT_LAYER_MAX_IMAGE_AREA = float(os.getenv("TEXT_LAYER_MAX_IMAGE_AREA", "0.2"))
+
+ocr_pages_total = counter("ocr_pages_total", "PDF pages by text source", ("route",))
+
+
+def usable_text(text: str) -> bool:
+    """Whether a page's text layer looks like real text rather than an empty or broken encoding."""
+    stripped = "".join(text.split())
+    if len(stripped) < TEXT_LAYER_MIN_CHARS:
+        return False
+    printable = sum(1 for c in stripped if c.isprintable() and c != "\ufffd")
+    return printable / len(stripped) >= TEXT_LAYER_MIN_PRINTABLE
+
+
+def untexted_image_area(page) -> float:
+    """
+    Fraction of a page covered by images that have no text-layer words over them. A searchable
+    scan's image is overlaid with its text; an image pasted into a generated page is not.
+    """
+    px0, py0, px1, py1 = page.rect
+    page_area = (px1 - px0) * (py1 - py0)
+    centres = [((w[0] + w[2]) / 2, (w[1] + w[3]) / 2) for w in page.get_text("words")]
+    area = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        x0, y0, x1, y1 = max(x0, px0), max(y0, py0), min(x1, px1), min(y1, py1)
+        if x1 <= x0 or y1 <= y0 or any(x0 <= x <= x1 and y0 <= y <= y1 for x, y in centres):
+            continue
+        area += (x1 - x0) * (y1 - y0)
+    return min(1.0, area / page_area) if page_area > 0 else 0.0
+
+
+def text_layer(doc: Document) -> List[Optional[str]]:
+    """Embedded text per page, or None for pages that need OCR (image-only, unusable or partly scanned)."""
+    with FITZ_LOCK, doc.open_pdf() as pdf_doc:
+        pages = [(page.get_text("text"), untexted_image_area(page)) for page in pdf_doc]
+    return [text if usable_text(text) and image_area < TEXT_LAYER_MAX_IMAGE_AREA else None
+            for text, image_area in pages]
+
+
+def ocr_image(doc: Document) -> str:
+    """OCR a single image document."""
+    with doc.open_image() as img:
+        return record(recognize_page(img)).strip()
+
+
+async def ocr_pages_async(doc: Document) -> List[str]:
     """
-    Extract text from a PDF or image via OCR.
+    Extract text per page from a PDF or image via OCR.
+    PDF pages with a usable text layer are read directly; the rest are rendered in batches
+    within the request's memory budget and OCR'd in parallel on the process pool.
     """
-    text = ""
-    if file_path.lower().endswith(".pdf"):
-        pdf_doc = fitz.open(file_path)
-        for page in pdf_doc:
-            pix = page.get_pixmap(dpi=300)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            text += pytesseract.image_to_string(img) + "\n"
+    if not doc.is_pdf:
+        with stage("ocr"):
+            return [await run_blocking(ocr_image, doc)]
+
+    if OCR_TEXT_LAYER:
+        with stage("text_layer"):
+            texts = await run_blocking(text_layer, doc)
     else:
-        with Image.open(file_path) as img:
-            text = pytesseract.image_to_string(img)
-    return text.strip()
+        texts = [None] * await run_blocking(count_pages, doc)
 
+    need_ocr = [i for i, text in enumerate(texts) if text is None]
+    ocr_pages_total.inc(len(texts) - len(need_ocr), route="text_layer")
+    ocr_pages_total.inc(len(need_ocr), route="tesseract")
+    async for pages, ocr_texts in iter_ocr(doc, need_ocr):
+        for i, text in zip(pages, ocr_texts):
+            texts[i] = text
+    return texts
 
-def llm_extract_text(text: str, model: str = "google/gemini-2.5-flash") -> Tuple[Dict, Dict | None]:
+
+async def ocr_extract_async(doc: Document) -> str:
+    """Extract the text of a PDF or image via OCR, pages joined by newlines."""
+    return "\n".join(await ocr_pages_async(doc)).strip()
+
+
+def ocr_extract(doc: Document) -> str:
+    """Synchronous wrapper around `ocr_extract_async`."""
+    return run_sync(ocr_extract_async, doc)
+
+
+async def llm_extract_text_async(text: str, model: str = "google/gemini-2.5-flash",
+                                 on_field: FieldCallback | None = None) -> Tuple[Dict, Dict | None]:
     """
     Send OCR-extracted text to OpenRouter/OpenAI LLM for structured JSON extraction.
     Also returns token usage if available.
@@ -37,44 +109,86 @@ def llm_extract_text(text: str, model: str = "google/gemini-2.5-flash") -> Tuple
     if not text:
         return {"error": "No text to analyze."}, None
 
-    complete_prompt = prompt + "Document text:" + text
+    try:
+        return await complete_structured(model, [{"type": "text", "text": "Document text:" + text}], on_field)
+    except Exception as e:
+        return {"error": str(e)}, None
 
-    payload = {
-        "model": model,
-        "messages": [{"role": "user", "content": [{"type": "text", "text": complete_prompt}]}],
-    }
 
-    headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
-    resp = requests.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers)
+async def structure_with_rules(text: str, model: str = "google/gemini-2.5-flash",
+                               on_field: FieldCallback | None = None) -> Tuple[Dict, Dict | None]:
+    """
+    Fill the sections the rules resolve from the text, and ask the LLM only for the rest with a
+    prompt reduced to those sections. Fully resolved documents never reach the LLM.
+    """
+    if not text:
+        return {"error": "No text to analyze."}, None
+    with stage("rules"):
+        found = extract_rules(text)
+    missing = tuple(section for section in SECTIONS if section not in found.fields)
+    usage = {"rules": {"resolved": list(found.fields), "llm_sections": list(missing)}, "llm_calls": 0}
+    if on_field is not None:
+        for key, value in found.fields.items():
+            on_field(key, value)
+    if not missing:
+        return {section: found.fields[section] for section in SECTIONS}, usage
+
+    def llm_field(key, value):
+        on_field(key, fill_hs_codes(value, found.hs_codes) if key == "CommodityDetails" else value)
 
     try:
-        resp.raise_for_status()
-        resp_json = resp.json()
-        raw_content = resp_json["choices"][0]["message"]["content"]
+        parsed, llm_usage = await complete_structured(
+            model, [{"type": "text", "text": "Document text:" + text}], llm_field if on_field else None,
+            variant="partial", template=partial_template(missing))
+    except Exception as e:
+        return {"error": str(e)}, None
+    result = {section: found.fields[section] if section in found.fields else parsed.get(section)
+              for section in SECTIONS}
+    if "CommodityDetails" in missing:
+        result["CommodityDetails"] = fill_hs_codes(result["CommodityDetails"], found.hs_codes)
+    return result, {**llm_usage, **usage, "llm_calls": 1}
 
-        # Clean markdown code fences
-        cleaned = re.sub(r"^```json\s*|\s*```$", "", raw_content.strip(), flags=re.MULTILINE)
-        cleaned = re.sub(r"^```\s*|\s*```$", "", cleaned.strip(), flags=re.MULTILINE)
 
-        # Repair any broken JSON
-        repaired = repair_json(cleaned)
-        parsed_data = json.loads(repaired)
+async def ocr_and_structure_async(doc: Document, model: str = "google/gemini-2.5-flash",
+                                  on_field: FieldCallback | None = None,
+                                  rules: bool = RULES_EXTRACTION) -> Tuple[Dict, Dict | None]:
+    """
+    High-level orchestrator: OCR a file and extract structured data via LLM.
+    OCR runs off the event loop (process pool for PDFs, bounded executor for images).
+    """
+    texts = await ocr_pages_async(doc)
+    return await structure_pages_async(texts, model, on_field, rules)
+
 
-        # Include token usage if present
-        usage = {}
-        if "usage" in resp_json:
-            usage = resp_json["usage"]
+async def structure_pages_async(texts: List[str], model: str = "google/gemini-2.5-flash",
+                                on_field: FieldCallback | None = None,
+                                rules: bool = RULES_EXTRACTION) -> Tuple[Dict, Dict | None]:
+    """
+    Extract structured data from per-page OCR text via LLM (after the rules, if `rules`).
+    Long documents are sent as concurrent page windows whose results are merged.
+    """
+    windows = [pages for pages in page_windows(len(texts)) if any(texts[i].strip() for i in pages)]
+    if len(windows) <= 1:
+        text = "\n".join(texts).strip()
+        if rules:
+            return await structure_with_rules(text, model, on_field)
+        return await llm_extract_text_async(text, model=model, on_field=on_field)
 
-        return parsed_data, usage
+    def window_content(pages: List[int], note: str) -> List[Dict]:
+        text = "\n".join(texts[i] for i in pages).strip()
+        return [{"type": "text", "text": note + "Document text:" + text}]
 
+    try:
+        return await complete_windows(model, len(texts), windows, window_content, on_field)
     except Exception as e:
         return {"error": str(e)}, None
 
 
+def llm_extract_text(text: str, model: str = "google/gemini-2.5-flash") -> Tuple[Dict, Dict | None]:
+    """Synchronous wrapper around `llm_extract_text_async`."""
+    return run_sync(llm_extract_text_async, text, model=model)
+
 
 def ocr_and_structure(file_path: str, model: str = "google/gemini-2.5-flash") -> Tuple[Dict, Dict | None]:
-    """
-    High-level orchestrator: OCR a file and extract structured data via LLM.
-    """
-    text = ocr_extract(file_path)
-    return llm_extract_text(text, model=model)
+    """Synchronous wrapper around `ocr_and_structure_async`."""
+    return run_sync(ocr_and_structure_async, Document.from_path(file_path), model=model)
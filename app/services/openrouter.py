@@ -0,0 +1,303 @@
+import asyncio
+import contextlib
+import email.utils
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Tuple
+
+import httpx
+
+from app.services.metrics import counter
+from app.services.routing import model_label
+from app.services.timing import labels, stage
+
+
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Connection pool and timeouts (seconds)
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+OPENROUTER_READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "120"))
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100"))
+OPENROUTER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20"))
+OPENROUTER_HTTP2 = os.getenv("OPENROUTER_HTTP2", "1") == "1"
+
+# Retries: jittered exponential backoff, Retry-After honoured when present
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))
+OPENROUTER_BACKOFF_BASE = float(os.getenv("OPENROUTER_BACKOFF_BASE", "0.5"))
+OPENROUTER_BACKOFF_MAX = float(os.getenv("OPENROUTER_BACKOFF_MAX", "30"))
+RETRY_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Upper bound on in-flight requests per model
+OPENROUTER_MODEL_CONCURRENCY = int(os.getenv("OPENROUTER_MODEL_CONCURRENCY", "16"))
+
+# Hedging (opt-in): if a completion is slower than this percentile of the model's recent
+# latencies, send a duplicate (optionally to a fallback model) and keep the first answer
+OPENROUTER_HEDGE = os.getenv("OPENROUTER_HEDGE", "0") == "1"
+OPENROUTER_HEDGE_PERCENTILE = float(os.getenv("OPENROUTER_HEDGE_PERCENTILE", "95"))
+OPENROUTER_HEDGE_MIN_DELAY = float(os.getenv("OPENROUTER_HEDGE_MIN_DELAY", "0.5"))
+OPENROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("OPENROUTER_HEDGE_MIN_SAMPLES", "20"))
+OPENROUTER_HEDGE_BUDGET = float(os.getenv("OPENROUTER_HEDGE_BUDGET", "0.1"))  # max share of calls hedged
+OPENROUTER_HEDGE_MODEL = os.getenv("OPENROUTER_HEDGE_MODEL")  # default: the same model
+LATENCY_WINDOW = 200
+
+requests_total = counter("openrouter_requests_total", "OpenRouter HTTP attempts by outcome", ("model", "status"))
+tokens_total = counter("openrouter_tokens_total", "Tokens used per extraction branch", ("mode", "model", "kind"))
+hedges_total = counter("openrouter_hedges_total", "Hedged completions by which request answered", ("model", "winner"))
+hedges_skipped_total = counter("openrouter_hedges_skipped_total", "Hedges not sent because the budget was spent", ("model",))
+hedge_wasted_tokens_total = counter("openrouter_hedge_wasted_tokens_total",
+                                    "Prompt tokens spent on cancelled hedge losers; an estimate, taken from "
+                                    "the winner's prompt token count", ("model",))
+
+_client: httpx.AsyncClient | None = None
+# Keyed by model_label, so unknown models share one entry
+_model_semaphores: Dict[str, asyncio.Semaphore] = {}
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared, pooled async HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        _client = httpx.AsyncClient(
+            base_url=OPENROUTER_BASE_URL,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else {},
+            timeout=httpx.Timeout(OPENROUTER_READ_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            ),
+            http2=OPENROUTER_HTTP2,
+        )
+    return _client
+
+
+async def aclose() -> None:
+    """Close the shared client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _model_semaphores.clear()
+
+
+def model_semaphore(model: str) -> asyncio.Semaphore:
+    model = model_label(model)
+    if model not in _model_semaphores:
+        _model_semaphores[model] = asyncio.Semaphore(OPENROUTER_MODEL_CONCURRENCY)
+    return _model_semaphores[model]
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry attempt."""
+    return random.uniform(0, min(OPENROUTER_BACKOFF_MAX, OPENROUTER_BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(resp: httpx.Response) -> float | None:
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date)."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0.0), OPENROUTER_BACKOFF_MAX)
+
+
+async def post_with_retries(path: str, payload: Dict, model: str, stream: bool = False) -> httpx.Response:
+    """
+    POST to OpenRouter under the model's concurrency limit, retrying transport errors
+    and retryable statuses. The last response is returned even if it is an error.
+    With `stream`, the body is left unread (the caller must close the response) and
+    the caller is expected to hold the model's semaphore for the whole stream.
+    """
+    client = get_client()
+    for attempt in range(OPENROUTER_MAX_RETRIES + 1):
+        try:
+            async with contextlib.nullcontext() if stream else model_semaphore(model):
+                resp = await client.send(client.build_request("POST", path, json=payload), stream=stream)
+        except httpx.TransportError:
+            requests_total.inc(model=model_label(model), status="transport_error")
+            if attempt == OPENROUTER_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            requests_total.inc(model=model_label(model), status=resp.status_code)
+            if resp.status_code not in RETRY_STATUSES or attempt == OPENROUTER_MAX_RETRIES:
+                return resp
+            delay = retry_after(resp)
+            await resp.aclose()
+            if delay is None:
+                delay = backoff_delay(attempt)
+        await asyncio.sleep(delay)
+
+
+def record_latency(model: str, seconds: float) -> None:
+    model = model_label(model)
+    if model not in _latencies:
+        _latencies[model] = deque(maxlen=LATENCY_WINDOW)
+    _latencies[model].append(seconds)
+
+
+def hedge_delay(model: str) -> float | None:
+    """Seconds to wait before hedging a call to `model`; None until enough latencies are known."""
+    history = _latencies.get(model_label(model))
+    if not history or len(history) < OPENROUTER_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(history)
+    k = min(len(ordered) - 1, int(len(ordered) * OPENROUTER_HEDGE_PERCENTILE / 100))
+    return max(OPENROUTER_HEDGE_MIN_DELAY, ordered[k])
+
+
+class HedgeBudget:
+    """Caps hedges to a share of recent completions so a slow provider cannot double all traffic."""
+
+    def __init__(self, ratio: float, window: int = 1000):
+        self.ratio = ratio
+        self._recent: Deque[bool] = deque(maxlen=window)
+        self._hedged = 0
+
+    def record(self, hedged: bool) -> None:
+        if len(self._recent) == self._recent.maxlen and self._recent[0]:
+            self._hedged -= 1
+        self._recent.append(hedged)
+        self._hedged += hedged
+
+    def allows(self) -> bool:
+        return self._hedged + 1 <= self.ratio * (len(self._recent) + 1)
+
+
+hedge_budget = HedgeBudget(OPENROUTER_HEDGE_BUDGET)
+
+
+async def timed_post(path: str, payload: Dict, model: str) -> httpx.Response:
+    start = time.perf_counter()
+    resp = await post_with_retries(path, payload, model)
+    if not resp.is_error:
+        record_latency(model, time.perf_counter() - start)
+    return resp
+
+
+async def hedged_post(path: str, payload: Dict, model: str) -> Tuple[httpx.Response, str, str | None]:
+    """
+    POST, and if no answer has come back by the model's hedge deadline, race a duplicate
+    request (to OPENROUTER_HEDGE_MODEL if set). The first successful response wins and the
+    other request is cancelled. Returns (response, model that answered, winner), where
+    winner is None when no hedge was sent, else "primary" or "hedge".
+    """
+    primary = asyncio.create_task(timed_post(path, payload, model))
+    racing = {primary: (model, "primary")}
+    try:
+        delay = hedge_delay(model) if OPENROUTER_HEDGE else None
+        if delay is not None:
+            await asyncio.wait({primary}, timeout=delay)
+        if delay is None or primary.done():
+            return await primary, model, None
+        if not hedge_budget.allows():
+            hedges_skipped_total.inc(model=model_label(model))
+            return await primary, model, None
+
+        hedge_model = OPENROUTER_HEDGE_MODEL or model
+        hedge = asyncio.create_task(timed_post(path, {**payload, "model": hedge_model}, hedge_model))
+        racing[hedge] = (hedge_model, "hedge")
+        while True:
+            done, _ = await asyncio.wait(racing, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                answered, winner = racing.pop(task)
+                # Keep waiting for the other request if this one failed
+                if not racing or (task.exception() is None and not task.result().is_error):
+                    hedges_total.inc(model=model_label(model), winner=winner)
+                    return task.result(), answered, winner
+    finally:
+        for task in racing:
+            task.cancel()
+
+
+def completion_payload(model: str, content: List[Dict], response_format: Dict | None = None, **extra) -> Dict:
+    payload = {"model": model, "messages": [{"role": "user", "content": content}], **extra}
+    if response_format is not None:
+        payload["response_format"] = response_format
+    return payload
+
+
+async def chat_completion(model: str, content: List[Dict], response_format: Dict | None = None) -> Tuple[str, Dict]:
+    """
+    Send a single-message chat completion to OpenRouter, hedged when OPENROUTER_HEDGE is on.
+    Returns the message content and token usage; raises on HTTP or payload errors.
+    """
+    payload = completion_payload(model, content, response_format)
+    with stage("upstream"):
+        resp, answered_by, winner = await hedged_post("/chat/completions", payload, model)
+    if OPENROUTER_HEDGE:
+        hedge_budget.record(winner is not None)
+    if resp.is_error:
+        raise RuntimeError(f"{resp.status_code} - {resp.text}")
+
+    resp_json = resp.json()
+    message_content = resp_json["choices"][0]["message"]["content"]
+    usage = resp_json.get("usage") or {}
+    token_labels = labels()
+    if winner is not None:
+        # The cancelled request had already been sent the whole prompt
+        loser = model if winner == "hedge" else OPENROUTER_HEDGE_MODEL or model
+        hedge_wasted_tokens_total.inc(usage.get("prompt_tokens") or 0, model=model_label(loser))
+        usage = {**usage, "hedge": {"winner": winner, "model": answered_by}}
+        # Tokens count against the model that answered
+        token_labels["model"] = model_label(answered_by)
+    for kind in ("prompt", "completion"):
+        tokens_total.inc(usage.get(f"{kind}_tokens") or 0, kind=kind, **token_labels)
+    return message_content, usage
+
+
+async def stream_chat_completion(model: str, content: List[Dict], usage: Dict,
+                                 response_format: Dict | None = None) -> AsyncIterator[str]:
+    """
+    Streamed variant of `chat_completion`: yields the message content as it arrives.
+    Token usage from the final chunk is written into `usage`.
+    """
+    payload = completion_payload(model, content, response_format, stream=True)
+    with stage("upstream"):
+        async with model_semaphore(model):
+            resp = await post_with_retries("/chat/completions", payload, model, stream=True)
+            try:
+                if resp.is_error:
+                    await resp.aread()
+                    raise RuntimeError(f"{resp.status_code} - {resp.text}")
+                async for line in resp.aiter_lines():
+                    # Server-sent events; lines starting with ':' are keep-alive comments
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if "error" in chunk:
+                        raise RuntimeError(f"Stream error - {chunk['error']}")
+                    if chunk.get("usage"):
+                        usage.update(chunk["usage"])
+                    for choice in chunk.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            yield delta
+            finally:
+                await resp.aclose()
+    for kind in ("prompt", "completion"):
+        tokens_total.inc(usage.get(f"{kind}_tokens") or 0, kind=kind, **labels())
+
+
+def run_sync(coro_fn, *args, **kwargs):
+    """Run an async extraction from synchronous code (e.g. the evaluation script)."""
+    async def runner():
+        try:
+            return await coro_fn(*args, **kwargs)
+        finally:
+            await aclose()
+
+    return asyncio.run(runner())
@@ -0,0 +1,144 @@
+import json
+import re
+from typing import Any, List, Tuple
+
+from app.services.lazy import lazy_import
+
+json_repair = lazy_import("json_repair")
+
+
+# Characters that change the scanner's state outside and inside strings
+_STRUCTURAL = re.compile(r'[{}\[\]",:]')
+_IN_STRING = re.compile(r'["\\]')
+
+
+class IncrementalJSONParser:
+    """
+    Parse a model's JSON object as it streams in, one chunk at a time.
+
+    Text before the first '{' (e.g. a ```json fence) is skipped. Each top-level
+    field is decoded as soon as its value is complete, so callers can act on
+    `Parties` before `CommodityDetails` has arrived. Every character is scanned
+    once; `repair_json` only runs if the finished output is not valid JSON.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: dict = {}
+        self._pos = 0            # next character to scan
+        self._start = None       # index of the top-level '{'
+        self._end = None         # index just past the matching '}'
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._broken = False     # the output is not a clean JSON object; fall back to repair at the end
+
+    @property
+    def complete(self) -> bool:
+        return self._end is not None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Add a chunk of model output; returns the top-level fields completed by it."""
+        self.text += chunk
+        completed = []
+        text = self.text
+        pos = self._pos
+        while pos < len(text) and self._end is None:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                m = _IN_STRING.search(text, pos)
+                if m is None:
+                    pos = len(text)
+                    break
+                pos = m.end()
+                if m.group() == "\\":
+                    self._escape = True
+                    continue
+                self._in_string = False
+                if self._depth == 1 and self._key_start is not None:
+                    try:
+                        self._key = json.loads(text[self._key_start:pos])
+                    except json.JSONDecodeError:
+                        self._broken = True
+                    self._key_start = None
+                continue
+
+            m = _STRUCTURAL.search(text, pos)
+            if m is None:
+                pos = len(text)
+                break
+            c, i = m.group(), m.start()
+            pos = m.end()
+            if self._start is None:
+                if c == "{":
+                    self._start, self._depth = i, 1
+                elif c == "[":
+                    self._broken = True  # a top-level array (or other non-object) is left to repair
+                continue
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = i
+            elif c in "{[":
+                self._depth += 1
+            elif c == ":" and self._depth == 1:
+                if self._key is None or self._value_start is not None:
+                    self._broken = True  # unquoted/single-quoted key, or a missing comma
+                self._value_start = pos
+            elif c == "," and self._depth == 1:
+                completed += self._close_field(text[self._value_start:i] if self._value_start else "")
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed += self._close_field(text[self._value_start:i] if self._value_start else "")
+                    self._end = pos
+        self._pos = pos
+        return completed
+
+    def _close_field(self, raw: str) -> List[Tuple[str, Any]]:
+        key, value_start, self._key, self._value_start = self._key, self._value_start, None, None
+        if key is None and value_start is None and not raw.strip():
+            return []  # "{}" or a trailing comma
+        if self._broken or key is None or value_start is None:
+            self._broken = True
+            return []
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self._broken = True
+            return []
+        self.fields[key] = value
+        return [(key, value)]
+
+    def finish(self) -> dict:
+        """The parsed object; repairs the full output if streaming could not decode it cleanly."""
+        if self.complete and not self._broken:
+            return self.fields
+        return parse_repaired(self.text)
+
+
+def parse_repaired(data_str: str) -> dict:
+    """Strip Markdown fences, repair the JSON if broken, and return it as a dict."""
+    # Remove markdown fences like ```json ... ```
+    cleaned = re.sub(r"^```json\s*|\s*```$", "", data_str.strip(), flags=re.MULTILINE)
+    cleaned = re.sub(r"^```\s*|\s*```$", "", cleaned.strip(), flags=re.MULTILINE)
+
+    repaired = json_repair.repair_json(cleaned)
+
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Still invalid JSON after repair: {e}\nContent: {repaired}")
+
+
+def parse_structured_data(data_str: str) -> dict:
+    """Parse a complete model response into a dict (fast path for valid JSON, repair otherwise)."""
+    parser = IncrementalJSONParser()
+    parser.feed(data_str)
+    return parser.finish()
@@ -0,0 +1,169 @@
+import math
+import operator
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.services.document import Document, Image
+from app.services.executor import run_blocking
+from app.services.metrics import counter, gauge
+from app.services.raster import PageRaster, get_rasters
+from app.services.timing import stage
+
+
+# Backend: "memory", "sqlite" or "none" (off). Templated invoices can look alike at this
+# resolution, so calibrate PHASH_MAX_DISTANCE on your own documents (bench/phash_index.py)
+PHASH_INDEX_BACKEND = os.getenv("PHASH_INDEX_BACKEND", "none")
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "phash_index.sqlite3")
+# Largest Hamming distance (out of HASH_BITS) still treated as the same document
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "10"))
+
+HASH_SIZE = 16                      # HASH_SIZE x HASH_SIZE lowest DCT frequencies
+HASH_BITS = HASH_SIZE * HASH_SIZE
+SAMPLE_SIZE = 64                    # the page is reduced to SAMPLE_SIZE x SAMPLE_SIZE grey levels first
+CHUNK_BITS = 16
+CHUNKS = HASH_BITS // CHUNK_BITS    # multi-index hashing finds every match within CHUNKS - 1 bits
+
+near_duplicate_lookups_total = counter("near_duplicate_lookups_total", "Perceptual-hash index lookups", ("result",))
+
+# DCT-II basis, one row per kept frequency
+_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * SAMPLE_SIZE)) for x in range(SAMPLE_SIZE)]
+        for u in range(HASH_SIZE)]
+
+
+def phash(img: "Image.Image") -> int:
+    """256-bit DCT perceptual hash: survives rescans, DPI changes and recompression of the same page."""
+    if img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    # Cheap integer reduction first, so the grey conversion and resampling touch few pixels
+    img = img.reduce(max(1, min(img.width, img.height) // (SAMPLE_SIZE * 4))).convert("L")
+    pixels = list(img.resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BOX).getdata())
+    rows = [pixels[y * SAMPLE_SIZE:(y + 1) * SAMPLE_SIZE] for y in range(SAMPLE_SIZE)]
+    # Separable 2-D DCT: transform the rows, then the columns, keeping low frequencies only
+    row_freqs = [[sum(map(operator.mul, row, basis)) for basis in _COS] for row in rows]
+    coeffs = [sum(map(operator.mul, column, basis)) for basis in _COS for column in zip(*row_freqs)]
+    median = sorted(coeffs[1:])[len(coeffs) // 2]  # the DC term would skew the median
+    value = 0
+    for c in coeffs:
+        value = (value << 1) | (c > median)
+    return value
+
+
+def distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def chunks(value: int) -> List[int]:
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (i * CHUNK_BITS)) & mask for i in range(CHUNKS)]
+
+
+def raster_phash(raster: PageRaster) -> int:
+    return phash(raster.to_image())
+
+
+def image_phash(doc: Document) -> int:
+    with doc.open_image() as img:
+        return phash(img)
+
+
+async def first_page_phash(doc: Document) -> Optional[int]:
+    """Hash of the document's first page; PDFs reuse the shared raster that extraction renders anyway."""
+    try:
+        with stage("phash"):
+            if not doc.is_pdf:
+                return await run_blocking(image_phash, doc)
+            raster = (await get_rasters(doc, [0]))[0]
+            return await run_blocking(raster_phash, raster)
+    except Exception:
+        return None  # unreadable or empty documents are simply not indexed
+
+
+class PHashIndex:
+    """
+    Multi-index hashing over SQLite: each hash is split into CHUNKS 16-bit chunks, each with its
+    own index. Two hashes within CHUNKS - 1 bits of each other share at least one chunk exactly,
+    so a lookup only compares the few rows that match a chunk instead of scanning the table.
+    Entries are scoped by extraction context and point at a result cache key.
+    """
+
+    def __init__(self, path: str = PHASH_INDEX_PATH, max_distance: int = PHASH_MAX_DISTANCE):
+        if max_distance >= CHUNKS:
+            raise ValueError(f"PHASH_MAX_DISTANCE must be below {CHUNKS}")
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"c{i} INTEGER NOT NULL" for i in range(CHUNKS))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS phashes ("
+            " result_key TEXT PRIMARY KEY, context TEXT NOT NULL, hash BLOB NOT NULL,"
+            f" created_at REAL NOT NULL, {columns})"
+        )
+        for i in range(CHUNKS):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS phashes_c{i} ON phashes (c{i}, context)")
+        self._lookup_sql = " UNION ".join(
+            f"SELECT result_key, hash FROM phashes WHERE c{i} = ? AND context = ?" for i in range(CHUNKS))
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM phashes").fetchone()[0]
+
+    def add(self, context: str, value: int, result_key: str) -> None:
+        row = (result_key, context, value.to_bytes(HASH_BITS // 8, "big"), time.time(), *chunks(value))
+        with self._lock:
+            cur = self._conn.execute(
+                f"INSERT OR IGNORE INTO phashes VALUES ({', '.join('?' * len(row))})", row)
+            self._entries += cur.rowcount
+
+    def add_many(self, entries: List[Tuple[str, int, str]]) -> None:
+        rows = [(key, context, value.to_bytes(HASH_BITS // 8, "big"), time.time(), *chunks(value))
+                for context, value, key in entries]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            cur = self._conn.executemany(
+                f"INSERT OR IGNORE INTO phashes VALUES ({', '.join('?' * (4 + CHUNKS))})", rows)
+            self._conn.execute("COMMIT")
+            self._entries += cur.rowcount
+
+    def nearest(self, context: str, value: int) -> Optional[Tuple[str, int]]:
+        """(result key, distance) of the closest indexed hash within max_distance, if any."""
+        params = [p for c in chunks(value) for p in (c, context)]
+        with self._lock:
+            rows = self._conn.execute(self._lookup_sql, params).fetchall()
+        best = None
+        for key, blob in rows:
+            d = distance(value, int.from_bytes(blob, "big"))
+            if d <= self.max_distance and (best is None or d < best[1]):
+                best = (key, d)
+        return best
+
+    def discard(self, result_key: str) -> None:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM phashes WHERE result_key = ?", (result_key,))
+            self._entries -= cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM phashes")
+            self._entries = 0
+
+    def __len__(self) -> int:
+        return self._entries
+
+    def stats(self) -> Dict:
+        return {"entries": self._entries, "max_distance": self.max_distance, "hash_bits": HASH_BITS}
+
+
+def make_index(name: str = PHASH_INDEX_BACKEND) -> Optional[PHashIndex]:
+    if name == "memory":
+        return PHashIndex(":memory:")
+    elif name == "sqlite":
+        return PHashIndex()
+    elif name == "none":
+        return None
+    raise ValueError(f"Unknown perceptual-hash index backend: {name}")
+
+
+phash_index = make_index()
+gauge("near_duplicate_index_entries", "Documents in the perceptual-hash index").set_function(
+    lambda: len(phash_index) if phash_index is not None else 0)
@@ -0,0 +1,295 @@
+import asyncio
+import os
+import time
+from typing import AsyncIterator, Dict, List, NamedTuple, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from app.schema.Response import Response
+from app.services.cache import cache_key, extraction_context, result_cache
+from app.services.document import Document
+from app.services.executor import run_blocking
+from app.services.llm_extraction import FieldCallback, llm_extract_async
+from app.services.metrics import counter, histogram
+from app.services.ocr_service import ocr_and_structure_async, ocr_pages_async, structure_pages_async
+from app.services.raster import shared_rasters
+from app.services.phash import first_page_phash, near_duplicate_lookups_total, phash_index
+from app.services.routing import AUTO_MODEL, cascade, model_label
+from app.services.singleflight import Flight, SingleFlight
+from app.services.timing import start_branch
+
+
+# Per-branch time limits in seconds
+OCR_BRANCH_TIMEOUT = float(os.getenv("OCR_BRANCH_TIMEOUT", "180"))
+LLM_BRANCH_TIMEOUT = float(os.getenv("LLM_BRANCH_TIMEOUT", "120"))
+
+MODES = ("ocr", "llm", "both")
+
+# Include each branch's stage durations in the response
+EXTRACT_RESPONSE_TIMINGS = os.getenv("EXTRACT_RESPONSE_TIMINGS", "0") == "1"
+
+# Let concurrent identical requests (same document, mode, models and prompt) share one extraction
+# instead of each calling upstream, e.g. client retries on timeout or a document submitted twice
+EXTRACT_COALESCE = os.getenv("EXTRACT_COALESCE", "1") == "1"
+
+# cache: "hit", "near" (near-duplicate), "miss", "off" or "coalesced" (joined an in-flight extraction)
+extract_seconds = histogram("extract_duration_seconds", "End-to-end extraction time", ("mode", "cache"))
+branch_errors_total = counter("extract_errors_total", "Extraction branches that returned an error", ("mode", "model"))
+coalesced_total = counter("extract_coalesced_total",
+                          "Requests served by joining an identical extraction already in flight", ("mode",))
+
+flights = SingleFlight()
+
+
+async def run_branch(coro, timeout: float) -> Tuple[Dict, Dict | None]:
+    """
+    Await one extraction branch under a timeout.
+    Failures are folded into an error result so a sibling branch is unaffected.
+    Note: work already handed to the executor keeps running after a timeout.
+    """
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        return {"error": f"Timed out after {timeout:g}s"}, None
+    except Exception as e:
+        return {"error": str(e)}, None
+
+
+def branch_response(result: Dict, usage: Dict | None, model: str, method: str, timings: Dict[str, float]) -> Response:
+    if usage and "route" in usage:
+        # Routed branch: report the model that produced the answer
+        model = usage["route"]["model"]
+    if "error" in result:
+        branch_errors_total.inc(mode=method, model=model_label(model))
+    return Response(
+        structured_data=result, model=model, method=method, usage=usage,
+        timings={name: round(seconds * 1000, 1) for name, seconds in timings.items()}
+        if EXTRACT_RESPONSE_TIMINGS else None,
+    )
+
+
+async def routed(extract, mode: str, on_field: FieldCallback | None) -> Tuple[Dict, Dict | None]:
+    """Run a branch through the model cascade; fields are reported once a model's answer is accepted."""
+    result, usage = await cascade(extract, mode)
+    if on_field is not None and "error" not in result:
+        for key, value in result.items():
+            on_field(key, value)
+    return result, usage
+
+
+async def ocr_routed(doc: Document, on_field: FieldCallback | None) -> Tuple[Dict, Dict | None]:
+    texts = await ocr_pages_async(doc)  # OCR once, whichever model ends up structuring it
+    return await routed(lambda model: structure_pages_async(texts, model), "ocr", on_field)
+
+
+async def extract_ocr(doc: Document, model: str, on_field: FieldCallback | None = None) -> Response:
+    timings = start_branch("ocr", model)
+    if model == AUTO_MODEL:
+        coro = ocr_routed(doc, on_field)
+    else:
+        coro = ocr_and_structure_async(doc, model, on_field=on_field)
+    result, usage = await run_branch(coro, OCR_BRANCH_TIMEOUT)
+    return branch_response(result, usage, model, 'ocr', timings)
+
+
+async def extract_llm(doc: Document, model: str, on_field: FieldCallback | None = None) -> Response:
+    timings = start_branch("llm", model)
+    if model == AUTO_MODEL:
+        coro = routed(lambda m: llm_extract_async(doc, m), "llm", on_field)
+    else:
+        coro = llm_extract_async(doc, model, on_field=on_field)
+    result, usage = await run_branch(coro, LLM_BRANCH_TIMEOUT)
+    return branch_response(result, usage, model, 'llm', timings)
+
+
+async def extract_both(doc: Document, model_ocr: str, model_llm: str,
+                       on_field: Dict[str, FieldCallback] | None = None) -> Dict[str, Response]:
+    """
+    Run the OCR and vision branches concurrently; latency is the slower of the two. The branches
+    share the pages either of them renders, whether or not the raster cache keeps them.
+    """
+    on_field = on_field or {}
+    with shared_rasters():
+        ocr, llm = await asyncio.gather(
+            extract_ocr(doc, model_ocr, on_field.get('ocr')),
+            extract_llm(doc, model_llm, on_field.get('llm')),
+        )
+    return {'OCR': ocr, 'LLM': llm}
+
+
+async def run_extraction(doc: Document, mode: str, model_ocr: str, model_llm: str,
+                         on_field: Dict[str, FieldCallback] | None = None):
+    """
+    Dispatch a document to the pipeline selected by `mode`.
+    `on_field` maps a method ('ocr'/'llm') to a callback that streams that branch's fields.
+    """
+    on_field = on_field or {}
+    if mode == "ocr":
+        return await extract_ocr(doc, model_ocr, on_field.get('ocr'))
+    elif mode == "llm":
+        return await extract_llm(doc, model_llm, on_field.get('llm'))
+    elif mode == "both":
+        return await extract_both(doc, model_ocr, model_llm, on_field)
+    raise ValueError(f"Invalid mode: {mode}")
+
+
+class CacheLookup(NamedTuple):
+    key: str
+    result: Dict | None      # cached result, if any
+    outcome: str             # "hit", "near" (near-duplicate document), "miss" or "off"
+    phash: int | None        # first-page hash to index a fresh result under
+
+
+async def lookup_cached(doc: Document, mode: str, model_ocr: str, model_llm: str) -> CacheLookup:
+    """
+    Look the extraction up in the result cache, then (when the perceptual-hash index is on)
+    under an earlier near-duplicate of the document: a rescan, re-export or fax of it.
+    """
+    key = await run_blocking(cache_key, doc, mode, model_ocr, model_llm)
+    if not result_cache.enabled:
+        return CacheLookup(key, None, "off", None)
+    cached = await run_blocking(result_cache.get, key)
+    if cached is not None:
+        return CacheLookup(key, cached, "hit", None)
+    if phash_index is None:
+        return CacheLookup(key, None, "miss", None)
+
+    value = await first_page_phash(doc)
+    if value is None:
+        return CacheLookup(key, None, "miss", None)
+    match = await run_blocking(phash_index.nearest, extraction_context(mode, model_ocr, model_llm), value)
+    cached = await run_blocking(result_cache.get, match[0]) if match else None
+    if cached is None:
+        if match:
+            await run_blocking(phash_index.discard, match[0])  # its result has left the cache
+        near_duplicate_lookups_total.inc(result="miss")
+        return CacheLookup(key, None, "miss", value)
+    near_duplicate_lookups_total.inc(result="hit")
+    await run_blocking(result_cache.set, key, cached)  # exact repeats of this copy hit directly
+    return CacheLookup(key, cached, "near", None)
+
+
+async def store_result(lookup: CacheLookup, result: Dict, mode: str, model_ocr: str, model_llm: str) -> None:
+    stored = await run_blocking(result_cache.set, lookup.key, result)
+    if stored and lookup.phash is not None:
+        await run_blocking(phash_index.add, extraction_context(mode, model_ocr, model_llm), lookup.phash, lookup.key)
+
+
+async def extract_and_store(lookup: CacheLookup, doc: Document, mode: str, model_ocr: str, model_llm: str,
+                            on_field: Dict[str, FieldCallback] | None = None) -> Dict:
+    result = jsonable_encoder(await run_extraction(doc, mode, model_ocr, model_llm, on_field))
+    await store_result(lookup, result, mode, model_ocr, model_llm)
+    return result
+
+
+def start_extraction(lookup: CacheLookup, doc: Document, mode: str, model_ocr: str, model_llm: str,
+                     on_field: Dict[str, FieldCallback] | None = None) -> Tuple[Flight, bool]:
+    """
+    Start extracting a cache miss, or join the identical extraction already in flight under
+    the same cache key (`on_field` then goes unused). Returns the flight and whether it was joined.
+    """
+    def start():
+        return extract_and_store(lookup, doc, mode, model_ocr, model_llm, on_field)
+
+    if not EXTRACT_COALESCE:
+        return Flight(asyncio.ensure_future(start())), False
+    flight, joined = flights.join(lookup.key, start)
+    if joined:
+        coalesced_total.inc(mode=mode)
+    return flight, joined
+
+
+def served(result: Dict, mode: str, outcome: str) -> Dict:
+    """
+    The result as returned to one request, marked with how it was served. Results this request
+    spent no tokens on (cached, a near-duplicate's, or shared with a request in flight) report
+    zero usage, with the usage of the extraction that produced them under `usage.cached`, and
+    no timings.
+    """
+    def mark(response: Dict) -> Dict:
+        response = {**response, "cache": outcome}
+        if outcome in ("hit", "near", "coalesced"):
+            if response.get("usage") is not None:
+                response["usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0,
+                                     "cached": response["usage"]}
+            response["timings"] = None
+        return response
+
+    return mark(result) if mode != "both" else {name: mark(response) for name, response in result.items()}
+
+
+def replay_events(result: Dict, mode: str) -> List[Dict]:
+    """The `field` events of a finished result, as its branches would have streamed them."""
+    return [{"event": "field", "method": response["method"], "key": field, "value": value}
+            for response in ([result] if mode != "both" else result.values())
+            for field, value in response["structured_data"].items()]
+
+
+async def extract_document(doc: Document, mode: str, model_ocr: str, model_llm: str) -> Dict:
+    """
+    Extract an uploaded document, serving repeats (and near-duplicates) from the result cache
+    and sharing the extraction of concurrent identical requests.
+    Returns the JSON-ready result (a Response dump, or {'OCR', 'LLM'} in mode=both).
+    """
+    start = time.perf_counter()
+    lookup = await lookup_cached(doc, mode, model_ocr, model_llm)
+    if lookup.result is not None:
+        extract_seconds.observe(time.perf_counter() - start, mode=mode, cache=lookup.outcome)
+        return served(lookup.result, mode, lookup.outcome)
+
+    flight, joined = start_extraction(lookup, doc, mode, model_ocr, model_llm)
+    result = await flight.wait()
+
+    outcome = "coalesced" if joined else lookup.outcome
+    extract_seconds.observe(time.perf_counter() - start, mode=mode, cache=outcome)
+    return served(result, mode, outcome)
+
+
+async def extract_document_stream(doc: Document, mode: str, model_ocr: str, model_llm: str) -> AsyncIterator[Dict]:
+    """
+    Streaming variant of `extract_document`. Yields a `field` event for each top-level
+    field as soon as the model has produced it, then one `result` event carrying the
+    same body `/extract` would return. Cache hits replay their fields immediately; requests
+    that join an identical in-flight extraction replay them once it finishes.
+    """
+    start = time.perf_counter()
+    lookup = await lookup_cached(doc, mode, model_ocr, model_llm)
+    if lookup.result is not None:
+        extract_seconds.observe(time.perf_counter() - start, mode=mode, cache=lookup.outcome)
+        for event in replay_events(lookup.result, mode):
+            yield event
+        yield {"event": "result", "result": served(lookup.result, mode, lookup.outcome)}
+        return
+
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emitter(method: str) -> FieldCallback:
+        return lambda field, value: events.put_nowait(
+            {"event": "field", "method": method, "key": field, "value": value})
+
+    flight, joined = start_extraction(lookup, doc, mode, model_ocr, model_llm,
+                                      {"ocr": emitter("ocr"), "llm": emitter("llm")})
+    if joined:
+        # Fields stream to the request that started the extraction
+        result = await flight.wait()
+        extract_seconds.observe(time.perf_counter() - start, mode=mode, cache="coalesced")
+        for event in replay_events(result, mode):
+            yield event
+        yield {"event": "result", "result": served(result, mode, "coalesced")}
+        return
+
+    task = flight.task
+    try:
+        while not task.done() or not events.empty():
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        result = task.result()
+    finally:
+        flight.release()  # cancels the extraction on disconnect, unless other requests joined it
+
+    extract_seconds.observe(time.perf_counter() - start, mode=mode, cache=lookup.outcome)
+    yield {"event": "result", "result": served(result, mode, lookup.outcome)}
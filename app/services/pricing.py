@@ -0,0 +1,29 @@
+from typing import Dict
+
+
+# USD per million tokens, as listed on OpenRouter
+TOKEN_PRICES = {
+    "openai/gpt-4o-mini": {"prompt": 0.15, "completion": 0.6},
+    "google/gemini-2.5-flash": {"prompt": 0.3, "completion": 2.5},
+    "google/gemini-2.0-flash-lite-001": {"prompt": 0.075, "completion": 0.3},
+    "google/gemini-2.5-flash-lite": {"prompt": 0.1, "completion": 0.4},
+    "meta-llama/llama-3.2-11b-vision-instruct": {"prompt": 0.049, "completion": 0.049},
+    "anthropic/claude-3.5-haiku": {"prompt": 0.8, "completion": 4},
+    "qwen/qwen-2.5-vl-7b-instruct": {"prompt": 0.2, "completion": 0.2},
+
+}
+
+
+def calculate_price(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    if model not in TOKEN_PRICES:
+        return 0
+    pricing = TOKEN_PRICES[model]
+    return (prompt_tokens / 1000000 * pricing["prompt"]) + \
+           (completion_tokens / 1000000 * pricing["completion"])
+
+
+def usage_cost(model: str, usage: Dict | None) -> float:
+    """Price of a completion's token usage in USD (0 for unknown models), at the rates of the model that answered."""
+    usage = usage or {}
+    model = usage.get("hedge", {}).get("model", model)
+    return calculate_price(model, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
@@ -0,0 +1,384 @@
+import asyncio
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from app.services.document import FITZ_LOCK, Document, Image, fitz
+from app.services.executor import run_blocking
+from app.services.image_prep import IMAGE_PREP_PROFILE, PreparedImage, prepare_image
+from app.services.metrics import gauge
+from app.services.layouts import PageText, record
+from app.services.ocr_pool import OCR_DPI, OCR_WORKERS, get_pool, ocr_raster, page_batches
+from app.services.timing import stage
+
+
+# Pages are rendered once at the highest DPI any consumer needs; lower resolutions are derived
+RASTER_DPI = int(os.getenv("RASTER_DPI", str(OCR_DPI)))
+# Raw rasters kept for reuse between the OCR and vision branches and across requests. Each worker
+# process holds its own cache (4 uvicorn workers at the default: up to 1 GB), and repeat documents
+# are mostly served by the result cache anyway
+RASTER_CACHE_BYTES = int(os.getenv("RASTER_CACHE_BYTES", str(256 * 1024 * 1024)))
+# Raster bytes one request may hold at a time; pages beyond it are rendered and consumed in batches
+PAGE_MEMORY_BUDGET = int(os.getenv("PAGE_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+# Raster bytes a mode=both request keeps for its second branch, whether or not the raster cache takes them
+REQUEST_RASTER_BYTES = int(os.getenv("REQUEST_RASTER_BYTES", str(PAGE_MEMORY_BUDGET)))
+
+
+class PageRaster(NamedTuple):
+    width: int
+    height: int
+    mode: str
+    dpi: int
+    samples: bytes
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.samples)
+
+    def to_image(self) -> "Image.Image":
+        # For "L" rasters a read-only view of the samples rather than a copy (PIL pads RGB to
+        # four bytes per pixel, so RGB is still copied)
+        return Image.frombuffer(self.mode, (self.width, self.height), self.samples, "raw", self.mode, 0, 1)
+
+
+class SizedLRU:
+    """Thread-safe LRU bounded by the total size of its values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[key] = (size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+class RequestRasters:
+    """One request's rendered pages, shared by its branches until the request ends (event loop only)."""
+
+    def __init__(self, max_bytes: int = REQUEST_RASTER_BYTES):
+        self.max_bytes = max_bytes
+        self._rasters: Dict[tuple, PageRaster] = {}
+        self._bytes = 0
+
+    def get(self, key: tuple) -> Optional[PageRaster]:
+        return self._rasters.get(key)
+
+    def put(self, key: tuple, raster: PageRaster) -> None:
+        if key not in self._rasters and self._bytes + raster.nbytes <= self.max_bytes:
+            self._rasters[key] = raster
+            self._bytes += raster.nbytes
+
+    def clear(self) -> None:
+        self._rasters.clear()
+        self._bytes = 0
+
+
+_request_rasters: ContextVar[Optional[RequestRasters]] = ContextVar("request_rasters", default=None)
+
+
+@contextmanager
+def shared_rasters():
+    """Let the tasks started inside the block (e.g. both branches of mode=both) share their rendered pages."""
+    rasters = RequestRasters()
+    token = _request_rasters.set(rasters)
+    try:
+        yield rasters
+    finally:
+        _request_rasters.reset(token)
+        rasters.clear()
+
+
+raster_cache = SizedLRU(RASTER_CACHE_BYTES)
+gauge("raster_cache_bytes", "Bytes held by the raster cache").set_function(lambda: raster_cache.nbytes)
+raster_batch_bytes = gauge("raster_batch_bytes", "Raster bytes held by in-flight page batches")
+
+# Renders in flight on this event loop, so concurrent branches wait instead of rendering twice
+_pending: Dict[tuple, asyncio.Future] = {}
+
+
+def render_pages(data: bytes, page_indices: List[int], dpi: int = RASTER_DPI) -> List[PageRaster]:
+    """Render pages of an in-memory PDF. Runs inside a worker process."""
+    rasters = []
+    with fitz.open(stream=data, filetype="pdf") as pdf_doc:
+        for i in page_indices:
+            pix = pdf_doc[i].get_pixmap(dpi=dpi)
+            samples = pix.samples
+            gray = samples[0::3]
+            # Greyscale scans are kept as one byte per pixel, which PIL can also map without copying
+            if gray == samples[1::3] == samples[2::3]:
+                rasters.append(PageRaster(pix.width, pix.height, "L", dpi, gray))
+            else:
+                rasters.append(PageRaster(pix.width, pix.height, "RGB", dpi, samples))
+            del pix, samples, gray
+    return rasters
+
+
+def render_and_ocr(data: bytes, page_indices: List[int], dpi: int = RASTER_DPI, profile: str | None = None,
+                   keep: bool = False) -> List[Tuple[PageText, Optional[PageRaster]]]:
+    """
+    Render and OCR pages in one worker process, so the rasters need not travel to the app and
+    back; they are only returned with `keep` (when another branch or the cache wants them).
+    """
+    results = []
+    for raster in render_pages(data, page_indices, dpi):
+        results.append((ocr_raster(raster, profile), raster if keep else None))
+    return results
+
+
+def count_pages(doc: Document) -> int:
+    key = (doc.sha256, "pages")
+    n = raster_cache.get(key)
+    if n is None:
+        with FITZ_LOCK, doc.open_pdf() as pdf_doc:
+            n = pdf_doc.page_count
+        raster_cache.put(key, n, 64)
+    return n
+
+
+def page_raster_bytes(doc: Document) -> List[int]:
+    """Upper bound of each page's raster size at RASTER_DPI (RGB), from the page geometry alone."""
+    key = (doc.sha256, "sizes")
+    sizes = raster_cache.get(key)
+    if sizes is None:
+        zoom = RASTER_DPI / 72
+        with FITZ_LOCK, doc.open_pdf() as pdf_doc:
+            sizes = [math.ceil(page.rect.width * zoom) * math.ceil(page.rect.height * zoom) * 3 for page in pdf_doc]
+        raster_cache.put(key, sizes, 64 + 8 * len(sizes))
+    return sizes
+
+
+def budget_batches(sizes: List[int], budget: int) -> List[List[int]]:
+    """Split positions 0..len(sizes)-1 into consecutive batches of at most `budget` bytes (at least one each)."""
+    batches: List[List[int]] = []
+    total = budget + 1
+    for k, size in enumerate(sizes):
+        if total + size > budget:
+            batches.append([])
+            total = 0
+        batches[-1].append(k)
+        total += size
+    return batches
+
+
+async def get_rasters(doc: Document, page_indices: List[int], executor: Optional[Executor] = None,
+                      workers: int = OCR_WORKERS, cache: bool = True) -> List[PageRaster]:
+    """
+    Return RASTER_DPI rasters for the given pages, rendering only pages that are neither
+    cached nor already being rendered. Missing pages are rendered on the process pool,
+    and kept in the raster cache unless `cache` is False.
+    """
+    found, waiting, missing = _lookup(doc, page_indices)
+    if missing:
+        loop = asyncio.get_running_loop()
+        with _rendering(doc, missing) as futures:
+            batches = [[missing[k] for k in batch] for batch in page_batches(len(missing), workers)]
+            with stage("render"):
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(executor or get_pool(), render_pages, doc.data, batch, RASTER_DPI)
+                    for batch in batches
+                ))
+            for batch, rasters in zip(batches, results):
+                for i, raster in zip(batch, rasters):
+                    _keep(doc, i, raster, cache)
+                    found[i] = raster
+                    futures[i].set_result(raster)
+
+    for i, fut in waiting.items():
+        found[i] = await fut
+    return [found[i] for i in page_indices]
+
+
+def _lookup(doc: Document, page_indices: List[int]) -> Tuple[Dict[int, PageRaster], Dict[int, asyncio.Future],
+                                                              List[int]]:
+    """Split pages into rasters at hand (this request's or cached), renders in flight, and pages to render."""
+    shared = _request_rasters.get()
+    found: Dict[int, PageRaster] = {}
+    waiting: Dict[int, asyncio.Future] = {}
+    missing: List[int] = []
+    for i in page_indices:
+        key = (doc.sha256, i)
+        raster = (shared.get(key) if shared is not None else None) or raster_cache.get(key)
+        if raster is not None:
+            found[i] = raster
+        elif key in _pending:
+            waiting[i] = _pending[key]
+        else:
+            missing.append(i)
+    return found, waiting, missing
+
+
+@contextmanager
+def _rendering(doc: Document, pages: List[int]):
+    """Mark renders of `pages` as in flight so concurrent branches wait for them; fails the waiters on error."""
+    loop = asyncio.get_running_loop()
+    futures = {i: loop.create_future() for i in pages}
+    _pending.update({(doc.sha256, i): fut for i, fut in futures.items()})
+    try:
+        yield futures
+    except BaseException as e:
+        for fut in futures.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"Rendering failed: {e!r}"))
+                fut.exception()  # mark retrieved; waiters still see it
+        raise
+    finally:
+        for i in pages:
+            _pending.pop((doc.sha256, i), None)
+
+
+def _keep(doc: Document, i: int, raster: PageRaster, cache: bool) -> None:
+    shared = _request_rasters.get()
+    if shared is not None:
+        shared.put((doc.sha256, i), raster)
+    if cache:
+        raster_cache.put((doc.sha256, i), raster, raster.nbytes)
+
+
+async def iter_rasters(doc: Document, page_indices: List[int],
+                       budget: int = PAGE_MEMORY_BUDGET) -> AsyncIterator[Tuple[List[int], List[PageRaster]]]:
+    """
+    Yield (pages, rasters) for `page_indices` in consecutive batches of at most `budget` raster
+    bytes, so a request only holds the batch it is working on; callers should drop each batch
+    before asking for the next. Documents too big for a quarter of the raster cache pass
+    through it uncached rather than evicting everyone else's pages (a mode=both request still
+    shares them between its branches, see `shared_rasters`).
+    """
+    wanted, cache = await _plan(doc, page_indices)
+    for batch in budget_batches(wanted, budget):
+        pages = [page_indices[k] for k in batch]
+        nbytes = sum(wanted[k] for k in batch)
+        raster_batch_bytes.inc(nbytes)
+        try:
+            yield pages, await get_rasters(doc, pages, cache=cache)
+        finally:
+            raster_batch_bytes.dec(nbytes)
+
+
+async def _plan(doc: Document, page_indices: List[int]) -> Tuple[List[int], bool]:
+    """Upper-bound raster size of each wanted page, and whether the raster cache should take them."""
+    sizes = await run_blocking(page_raster_bytes, doc)
+    wanted = [sizes[i] for i in page_indices]
+    return wanted, sum(wanted) <= RASTER_CACHE_BYTES // 4
+
+
+async def iter_ocr(doc: Document, page_indices: List[int], budget: int = PAGE_MEMORY_BUDGET,
+                   profile: str | None = None) -> AsyncIterator[Tuple[List[int], List[str]]]:
+    """
+    Yield (pages, texts) for `page_indices` in batches of at most `budget` raster bytes. Pages
+    already rendered (by this request's other branch, or cached) are OCR'd from their rasters;
+    the rest are rendered and OCR'd in the same worker process, and their rasters only come
+    back to the app when something will reuse them.
+    """
+    wanted, cache = await _plan(doc, page_indices)
+    keep = cache or _request_rasters.get() is not None
+    for batch in budget_batches(wanted, budget):
+        pages = [page_indices[k] for k in batch]
+        nbytes = sum(wanted[k] for k in batch)
+        raster_batch_bytes.inc(nbytes)
+        try:
+            found, waiting, missing = _lookup(doc, pages)
+            rendered = [i for i in pages if i not in missing]
+            # Registered before any await, so the other branch waits for these pages instead of rendering them
+            with _rendering(doc, missing if keep else []) as futures, stage("ocr"):
+                texts, reused = await asyncio.gather(
+                    _render_and_ocr(doc, missing, profile, futures, cache),
+                    asyncio.gather(*(_ocr_when_ready(found.get(i) or waiting[i], profile) for i in rendered)),
+                )
+            texts.update(zip(rendered, reused))
+            yield pages, [record(texts[i]) for i in pages]
+        finally:
+            raster_batch_bytes.dec(nbytes)
+
+
+async def _render_and_ocr(doc: Document, pages: List[int], profile: str | None,
+                          futures: Dict[int, asyncio.Future], cache: bool) -> Dict[int, PageText]:
+    """Render and OCR pages on the pool; rasters are kept and handed to waiters when `futures` has them."""
+    if not pages:
+        return {}
+    loop = asyncio.get_running_loop()
+    keep = bool(futures)
+    chunks = [[pages[k] for k in chunk] for chunk in page_batches(len(pages), OCR_WORKERS)]
+    results = await asyncio.gather(*(
+        loop.run_in_executor(get_pool(), render_and_ocr, doc.data, chunk, RASTER_DPI, profile, keep)
+        for chunk in chunks
+    ))
+    texts = {}
+    for chunk, pairs in zip(chunks, results):
+        for i, (page, raster) in zip(chunk, pairs):
+            if keep:
+                _keep(doc, i, raster, cache)
+                futures[i].set_result(raster)
+            texts[i] = page
+    return texts
+
+
+async def _ocr_when_ready(raster, profile: str | None) -> PageText:
+    if isinstance(raster, asyncio.Future):
+        raster = await raster
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), ocr_raster, raster, profile)
+
+
+def prepare_raster(raster: PageRaster, model: str, dpi: int = 200, profile: str | None = None) -> PreparedImage:
+    """Derive the vision-model image for a page from its raster (downscaled to `dpi`)."""
+    return prepare_image(raster.to_image(), model, profile, scale=min(1.0, dpi / raster.dpi))
+
+
+async def prepare_pages(doc: Document, page_indices: List[int], model: str, dpi: int = 200,
+                        profile: str | None = None) -> List[PreparedImage]:
+    """Encoded page images for the vision model, derived from cached rasters and cached themselves."""
+    profile = profile or IMAGE_PREP_PROFILE
+    images: Dict[int, PreparedImage] = {}
+    missing = []
+    for i in page_indices:
+        image = raster_cache.get((doc.sha256, i, "image", dpi, profile, model))
+        if image is None:
+            missing.append(i)
+        else:
+            images[i] = image
+
+    async for pages, rasters in iter_rasters(doc, missing):
+        with stage("encode"):
+            prepared = await asyncio.gather(*(run_blocking(prepare_raster, r, model, dpi, profile) for r in rasters))
+        del rasters  # only the encoded images outlive the batch
+        for i, image in zip(pages, prepared):
+            raster_cache.put((doc.sha256, i, "image", dpi, profile, model), image, len(image.data_url))
+            images[i] = image
+    return [images[i] for i in page_indices]
@@ -0,0 +1,110 @@
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from app.services.chunking import merge_usage
+from app.services.metrics import counter, histogram
+from app.services.pricing import TOKEN_PRICES, usage_cost
+
+
+# Passing this as model_ocr / model_llm routes the branch through the cascade
+AUTO_MODEL = "auto"
+
+# Models tried in order; each later model is only called when the previous answer fails validation
+ROUTE_CASCADE = [m.strip() for m in os.getenv(
+    "ROUTE_CASCADE", "google/gemini-2.0-flash-lite-001,google/gemini-2.5-flash").split(",") if m.strip()]
+
+# Models that get their own metric series and per-model client state; any other (client-supplied)
+# model string is grouped under "other" so it cannot create unbounded label values or dict entries
+KNOWN_MODELS = frozenset(TOKEN_PRICES) | frozenset(ROUTE_CASCADE) | {AUTO_MODEL}
+
+# Four-digit heading, optionally followed by subheading digits (6109, 6109.10, 6109.10.00, 61091000)
+HS_CODE = re.compile(r"^\d{4}(?:[.\s]?\d{2}){0,3}$")
+
+route_requests_total = counter("route_requests_total", "Cascade-routed extractions by route taken", ("mode", "route"))
+route_escalations_total = counter("route_escalations_total", "Cascade escalations away from a model", ("mode", "model"))
+route_cost_usd_total = counter("route_cost_usd_total", "Token cost of cascade-routed extractions", ("mode", "route"))
+route_seconds = histogram("route_duration_seconds", "Latency of cascade-routed extractions", ("mode", "route"))
+
+
+def model_label(model: str) -> str:
+    return model if model in KNOWN_MODELS else "other"
+
+
+def validate(result: Dict) -> List[str]:
+    """Problems that make an extraction worth retrying on a stronger model (empty if it looks complete)."""
+    if "error" in result:
+        return [f"error: {result['error']}"]
+    problems = []
+
+    parties = result.get("Parties")
+    if not isinstance(parties, list) or not parties:
+        problems.append("no Parties")
+    elif any(not isinstance(p, dict) or not p.get("PartyName") for p in parties):
+        problems.append("party without PartyName")
+
+    overview = result.get("CountryOverview")
+    if not isinstance(overview, dict):
+        problems.append("no CountryOverview")
+    else:
+        for key in ("CountryOfOrigin", "CountryOfDestination", "TransitCountry"):
+            if key not in overview:
+                problems.append(f"CountryOverview.{key} missing")
+
+    commodities = result.get("CommodityDetails")
+    if not isinstance(commodities, list) or not commodities:
+        problems.append("no CommodityDetails")
+    else:
+        for item in commodities:
+            hs_code = item.get("HSCode") if isinstance(item, dict) else None
+            if hs_code is None:
+                problems.append("null HSCode")
+            elif not HS_CODE.match(str(hs_code).strip()):
+                problems.append(f"malformed HSCode {hs_code!r}")
+
+    if not isinstance(result.get("Transportation"), dict):
+        problems.append("no Transportation")
+    return problems
+
+
+async def cascade(extract: Callable[[str], Awaitable[Tuple[Dict, Dict | None]]], mode: str,
+                  models: List[str] | None = None) -> Tuple[Dict, Dict]:
+    """
+    Run `extract(model)` on each model of the cascade until a result passes `validate`.
+    The last model's answer is accepted as is. The returned usage sums the tokens of every
+    attempt and describes the route (including the model that answered) under "route".
+    """
+    models = models or ROUTE_CASCADE
+    start = time.perf_counter()
+    attempts = []
+    usages = []
+    cost = 0.0
+    for i, model in enumerate(models):
+        result, usage = await extract(model)
+        problems = validate(result)
+        cost += usage_cost(model, usage)
+        usages.append(usage or {})
+        attempts.append({"model": model, "problems": problems,
+                         "total_tokens": (usage or {}).get("total_tokens")})
+        if not problems or i == len(models) - 1:
+            break
+        route_escalations_total.inc(mode=mode, model=model)
+
+    route = ">".join(a["model"] for a in attempts)
+    route_requests_total.inc(mode=mode, route=route)
+    route_cost_usd_total.inc(cost, mode=mode, route=route)
+    route_seconds.observe(time.perf_counter() - start, mode=mode, route=route)
+
+    total = merge_usage(usages) if any(usages) else {}
+    final = usages[-1]
+    # Keep non-token details (e.g. image_prep) of the accepted attempt
+    total.update({k: v for k, v in final.items() if not isinstance(v, (int, float))})
+    total["cost"] = cost
+    total["route"] = {"model": attempts[-1]["model"], "attempts": attempts, "escalated": len(attempts) > 1}
+    return result, total
+
+
+def cache_name(model: str) -> str:
+    """Model identity for cache keys; the cascade is keyed by its model list."""
+    return f"{AUTO_MODEL}:{','.join(ROUTE_CASCADE)}" if model == AUTO_MODEL else model
@@ -0,0 +1,173 @@
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.metrics import counter
+
+
+# Resolve explicitly labelled fields from the document text with regexes, and only ask the
+# LLM (with a prompt reduced to the remaining sections) for what they cannot settle
+RULES_EXTRACTION = os.getenv("RULES_EXTRACTION", "0") == "1"
+
+SECTIONS = ("Parties", "CountryOverview", "CommodityDetails", "Transportation")
+
+rules_extractions_total = counter("rules_extractions_total",
+                                  "Rule-based extractions by outcome (complete: no LLM call)", ("outcome",))
+rules_sections_total = counter("rules_sections_total", "Sections resolved by the rules", ("section",))
+
+_EMPTY_VALUES = {"n/a", "na", "none", "nil", "-", "--", "null"}
+_HS_LABEL = r"(?:HSN?\b|H\.S\.)"
+
+
+def _value(stop: str = "") -> str:
+    """
+    "Label: value" (or "Label - value", "Label # value"): the value runs to the end of the line, a
+    tab or two spaces (the next column of a laid-out page), or the `stop` pattern
+    """
+    end = r"[ \t]*(?:\t| {2})|[ \t]*$" + (r"|[ \t]+" + stop if stop else "")
+    return r"[ \t]*[:#\-][ \t]*(?P<value>[^\n]*?\S)(?=" + end + ")"
+
+
+def _labelled(*labels: str, stop: str = "") -> re.Pattern:
+    return re.compile(r"^[ \t]*(?:" + "|".join(labels) + r")\b" + _value(stop), re.IGNORECASE | re.MULTILINE)
+
+
+def _mention(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+# (section, field) -> (labelled value, any mention). A field is settled when it has exactly one
+# labelled value, or when the document does not mention it at all (the prompt asks for null then)
+FIELD_RULES: Dict[Tuple[str, str], Tuple[re.Pattern, re.Pattern]] = {
+    ("CountryOverview", "CountryOfOrigin"): (
+        _labelled(r"country\s+of\s+origin", r"origin\s+country", r"made\s+in"),
+        _mention(r"\borigin\b|\bmade\s+in\b")),
+    ("CountryOverview", "CountryOfDestination"): (
+        _labelled(r"country\s+of\s+(?:final\s+)?destination", r"(?:final\s+)?destination\s+country",
+                  r"final\s+destination"),
+        _mention(r"\bdestination\b")),
+    ("CountryOverview", "TransitCountry"): (
+        _labelled(r"(?:country\s+of\s+)?transit(?:\s+country)?"),
+        _mention(r"\btransit\b|\bvia\b")),
+    ("Transportation", "MeansOfTransport"): (
+        _labelled(r"(?:means|mode)\s+of\s+transport(?:ation)?", r"transport\s+mode", r"shipped\s+(?:by|via)"),
+        _mention(r"\btransport|\bshipped\s+(?:by|via)\b")),
+    ("Transportation", "VesselNumber"): (
+        _labelled(r"vessel(?:\s*(?:no\.?|number|name))?", r"voyage(?:\s*no\.?)?", r"flight\s*no\.?"),
+        _mention(r"\bvessel\b|\bvoyage\b|\bflight\b")),
+}
+
+HS_LABELLED = re.compile(r"\b" + _HS_LABEL + r"(?:[ \t]*(?:Code|No\.?))?[ \t]*[:#]?[ \t]*(\d{4}\.\d{2}(?:\.\d{2,4})?)\b",
+                         re.IGNORECASE)
+# A description stops where an HS code on the same line starts
+DESCRIPTION = _labelled(r"description(?:\s+of\s+goods)?", r"goods", r"commodity", r"product", stop=_HS_LABEL)
+
+SELLER_ROLES = ("exporter", "shipper", "seller", "consignor")
+BUYER_ROLES = ("consignee", "buyer", "importer")
+PARTY = re.compile(r"^[ \t]*(?P<role>" + "|".join(SELLER_ROLES + BUYER_ROLES) + r")\b" + _value(),
+                   re.IGNORECASE | re.MULTILINE)
+# A "City, Country" line of a party's address block
+LOCATION = re.compile(r"^[ \t]*(?P<city>[^\W\d_][^\W\d_ .'\-]*(?:[ .'\-]+[^\W\d_]+)*\.?)[ \t]*,"
+                      r"[ \t]*(?P<country>[^\W\d_][^\W\d_ .'\-]*(?:[ .'\-]+[^\W\d_]+)*\.?)[ \t]*$")
+# Any "Label:" line, which ends a party's address block
+LABEL_LINE = re.compile(r"^[ \t]*[^\W\d_][\w .'/&()\-]*?[ \t]*[:#]")
+# Countries a "City, Country" line is trusted on wherever it sits in an address block
+COUNTRIES = frozenset(c.lower() for c in (
+    "Argentina", "Australia", "Austria", "Bangladesh", "Belgium", "Brazil", "Canada", "Chile", "China", "Colombia",
+    "Czech Republic", "Denmark", "Egypt", "Finland", "France", "Germany", "Greece", "Hong Kong", "Hungary", "India",
+    "Indonesia", "Ireland", "Israel", "Italy", "Japan", "Kenya", "Korea", "South Korea", "Malaysia", "Mexico",
+    "Morocco", "Netherlands", "New Zealand", "Nigeria", "Norway", "Pakistan", "Peru", "Philippines", "Poland",
+    "Portugal", "Qatar", "Romania", "Russia", "Saudi Arabia", "Singapore", "South Africa", "Spain", "Sri Lanka",
+    "Sweden", "Switzerland", "Taiwan", "Thailand", "Turkey", "UAE", "United Arab Emirates", "UK",
+    "United Kingdom", "USA", "U.S.A.", "US", "United States", "Vietnam",
+))
+# Parties the rules do not model; their presence leaves Parties to the LLM
+OTHER_PARTIES = _mention(r"\bnotify\s+party\b|\bmanufacturer\b|\bagent\b|\bsold\s+to\b|\bship\s+to\b|\bbill\s+to\b")
+
+
+class RuleResult(NamedTuple):
+    fields: Dict[str, Any]      # sections resolved with confidence, in the response structure
+    hs_codes: List[str]         # every labelled HS code, in document order
+
+
+def _clean(value: str) -> Optional[str]:
+    # Trailing periods stay: they end names such as "Pvt. Ltd." and "Co."
+    value = value.strip().rstrip(",;").rstrip()
+    return None if value.lower() in _EMPTY_VALUES else value
+
+
+def resolve_field(text: str, labelled: re.Pattern, mention: re.Pattern) -> Tuple[bool, Optional[str]]:
+    values = {_clean(m.group("value")) for m in labelled.finditer(text)}
+    if len(values) == 1:
+        return True, values.pop()
+    return not values and not mention.search(text), None
+
+
+def party_location(text: str, end: int) -> Optional[re.Match]:
+    """
+    The "City, Country" line of the address block below a party (its lines up to the next label
+    or blank line): one naming a known country, else the block's last line if a label follows it.
+    A street line such as "Plot 12, MIDC Andheri" alone is never taken for a location.
+    """
+    lines = text[end:].split("\n")[1:]
+    block = []
+    for line in lines:
+        if not line.strip() or LABEL_LINE.match(line):
+            break
+        block.append(line)
+    known = [m for m in map(LOCATION.match, block) if m is not None and m.group("country").lower() in COUNTRIES]
+    if known:
+        return known[-1]
+    if block and len(block) < len(lines) and LABEL_LINE.match(lines[len(block)]):
+        return LOCATION.match(block[-1])
+    return None
+
+
+def resolve_parties(text: str) -> Optional[List[Dict]]:
+    parties = []
+    for m in PARTY.finditer(text):
+        location = party_location(text, m.end())
+        if location is None:
+            return None
+        parties.append({"PartyName": _clean(m.group("value")), "Role": m.group("role").title(),
+                        "Location": {"City": location.group("city"), "Country": location.group("country")}})
+    roles = {p["Role"].lower() for p in parties}
+    if roles.isdisjoint(SELLER_ROLES) or roles.isdisjoint(BUYER_ROLES) or OTHER_PARTIES.search(text):
+        return None
+    return parties
+
+
+def extract_rules(text: str) -> RuleResult:
+    """Resolve whatever sections the document text states explicitly enough to need no LLM."""
+    fields: Dict[str, Any] = {}
+    parties = resolve_parties(text)
+    if parties is not None:
+        fields["Parties"] = parties
+
+    sections: Dict[str, Optional[Dict]] = {}
+    for (section, field), (labelled, mention) in FIELD_RULES.items():
+        resolved, value = resolve_field(text, labelled, mention)
+        if section not in sections:
+            sections[section] = {}
+        if sections[section] is not None:
+            sections[section] = {**sections[section], field: value} if resolved else None
+    fields.update({section: values for section, values in sections.items() if values is not None})
+
+    hs_codes = HS_LABELLED.findall(text)
+    descriptions = [_clean(m.group("value")) for m in DESCRIPTION.finditer(text)]
+    if hs_codes and len(descriptions) == len(hs_codes):
+        fields["CommodityDetails"] = [{"DescriptionOfGoods": d, "HSCode": hs}
+                                      for d, hs in zip(descriptions, hs_codes)]
+
+    for section in fields:
+        rules_sections_total.inc(section=section)
+    outcome = "complete" if len(fields) == len(SECTIONS) else "partial" if fields else "none"
+    rules_extractions_total.inc(outcome=outcome)
+    return RuleResult(fields, hs_codes)
+
+
+def fill_hs_codes(items: Any, hs_codes: List[str]) -> Any:
+    """Use the labelled HS codes for an LLM's commodities when they line up one to one."""
+    if not isinstance(items, list) or not hs_codes or len(items) != len(hs_codes):
+        return items
+    return [{**item, "HSCode": hs} if isinstance(item, dict) else item for item, hs in zip(items, hs_codes)]
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class Flight:
+    """One in-flight call and the number of callers still waiting for it."""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 1
+
+    def release(self) -> None:
+        """Drop a waiter; the call is cancelled once nobody is left waiting for it."""
+        self.waiters -= 1
+        if self.waiters == 0 and not self.task.done():
+            self.task.cancel()
+
+    async def wait(self) -> Any:
+        # Shielded: a caller that gives up (client disconnect, timeout) leaves the call to the others
+        try:
+            return await asyncio.shield(self.task)
+        finally:
+            self.release()
+
+
+class SingleFlight:
+    """
+    Share one run of a coroutine among concurrent callers with the same key: the first
+    caller starts it, callers arriving while it runs attach to it and get the same result
+    (or exception). Keys are forgotten as soon as the call finishes.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def join(self, key: str, start: Callable[[], Awaitable[Any]]) -> Tuple[Flight, bool]:
+        """The flight for `key`, starting it with `start()` if none is running; True if joined."""
+        flight = self._flights.get(key)
+        # A flight with no waiters left is being cancelled: start afresh
+        if flight is not None and flight.waiters > 0 and not flight.task.done():
+            flight.waiters += 1
+            return flight, True
+        flight = Flight(asyncio.ensure_future(start()))
+        self._flights[key] = flight
+        flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        return flight, False
+
+    def _forget(self, key: str, flight: Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def __len__(self) -> int:
+        return len(self._flights)
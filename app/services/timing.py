@@ -0,0 +1,62 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Tuple
+
+from app.services.metrics import histogram
+from app.services.routing import model_label
+
+
+# Stage durations (seconds) for the request being handled; concurrent branches share one dict
+_timings: ContextVar[Dict[str, float] | None] = ContextVar("timings", default=None)
+# The extraction branch being run: (mode, model) labels and that branch's own stage durations
+_branch: ContextVar[Tuple[str, str, Dict[str, float] | None]] = ContextVar("branch", default=("", "", None))
+
+stage_seconds = histogram("extract_stage_seconds", "Time spent per extraction stage", ("stage", "mode", "model"))
+
+
+def start_request() -> Dict[str, float]:
+    """Begin collecting stage timings for the current request and return the dict they land in."""
+    timings: Dict[str, float] = {}
+    _timings.set(timings)
+    return timings
+
+
+def current() -> Dict[str, float] | None:
+    return _timings.get()
+
+
+def start_branch(mode: str, model: str) -> Dict[str, float]:
+    """
+    Label work in the current task with an extraction mode and model, and collect that
+    branch's stage durations separately. Call at the start of a task (e.g. one gather arm).
+    """
+    timings: Dict[str, float] = {}
+    _branch.set((mode, model_label(model), timings))
+    return timings
+
+
+def labels() -> Dict[str, str]:
+    """The (mode, model) metric labels of the current branch."""
+    mode, model, _ = _branch.get()
+    return {"mode": mode, "model": model}
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent inside the block to stage `name` of the current request and branch."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        mode, model, branch = _branch.get()
+        stage_seconds.observe(elapsed, stage=name, mode=mode, model=model)
+        for timings in (_timings.get(), branch):
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """Format timings as a Server-Timing header value (durations in milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
@@ -0,0 +1,231 @@
+"""
+Offline latency/throughput benchmark for /extract.
+
+Starts the OpenRouter stub and the app on local ports (unless --url is given),
+drives /extract in each mode at fixed concurrency levels and reports p50/p95/p99
+latency, requests/sec and the per-stage breakdown from the Server-Timing header.
+
+    python -m bench.bench_suite invoice.pdf --modes llm ocr both --concurrency 1 8 32 \\
+        --requests 64 --out bench.json
+
+Compare against an earlier run (e.g. from the previous commit):
+
+    python -m bench.bench_suite invoice.pdf --out new.json --compare old.json
+
+The result and raster caches are disabled in the spawned app so every request does
+the full work; pass --warm to keep them. Coalescing of concurrent identical requests
+is always off there, as every request sends the same file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+STAGES = ("render", "encode", "text_layer", "ocr", "upstream", "parse", "total")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of `values` (q in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[k]
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Stage durations in seconds from a Server-Timing header."""
+    timings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name] = float(value) / 1000
+    return timings
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    return {
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up within {timeout:g}s")
+            await asyncio.sleep(0.2)
+
+
+@contextmanager
+def servers(args):
+    """Run the stub and the app as subprocesses for the duration of the benchmark."""
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent.parent),
+                                                    os.environ.get("PYTHONPATH")])),
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_ERROR_RATE": str(args.stub_error_rate),
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.stub_port}/api/v1",
+        "EXTRACT_COALESCE": "0",
+    }
+    if not args.warm:
+        env.update({"RESULT_CACHE_BACKEND": "none", "RASTER_CACHE_BYTES": "0"})
+    procs = [
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "bench.openrouter_stub:app",
+                          "--port", str(args.stub_port), "--log-level", "warning"], env=env),
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app",
+                          "--port", str(args.app_port), "--log-level", "warning"], env=env),
+    ]
+    try:
+        yield
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+async def run_level(client: httpx.AsyncClient, args, data: bytes, mode: str, concurrency: int) -> Dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                resp = await client.post(
+                    f"{args.url}/extract",
+                    files={"file": (Path(args.file).name, data)},
+                    data={"mode": mode, "model_ocr": args.model, "model_llm": args.model},
+                )
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latency = time.perf_counter() - start
+            if resp.is_error or _has_error(resp.json()):
+                errors += 1
+                return
+            latencies.append(latency)
+            for name, seconds in parse_server_timing(resp.headers.get("Server-Timing", "")).items():
+                stages.setdefault(name, []).append(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "wall_sec": elapsed,
+        "rps": len(latencies) / elapsed,
+        "latency": summarize(latencies),
+        "stages": {name: summarize(values) for name, values in stages.items()},
+    }
+
+
+def _has_error(body: Dict) -> bool:
+    responses = body.values() if "OCR" in body else [body]
+    return any(isinstance(r, dict) and "error" in (r.get("structured_data") or {}) for r in responses)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Dict], baseline: Dict | None = None) -> None:
+    previous = {(r["mode"], r["concurrency"]): r for r in (baseline or {}).get("results", [])}
+    header = f"{'mode':<6}{'conc':>5}{'rps':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'err':>5}  stages (mean ms)"
+    print(header)
+    for r in results:
+        lat = r["latency"]
+        stages = " ".join(f"{name}={r['stages'][name]['mean'] * 1000:.0f}"
+                          for name in STAGES if name in r["stages"] and name != "total")
+        print(f"{r['mode']:<6}{r['concurrency']:>5}{r['rps']:>8.2f}{lat['p50']:>8.3f}{lat['p95']:>8.3f}"
+              f"{lat['p99']:>8.3f}{r['errors']:>5}  {stages}")
+        old = previous.get((r["mode"], r["concurrency"]))
+        if old:
+            def delta(new, before):
+                return f"{(new - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{'':<11}vs baseline: rps {delta(r['rps'], old['rps'])}, "
+                  f"p50 {delta(lat['p50'], old['latency']['p50'])}, p95 {delta(lat['p95'], old['latency']['p95'])}, "
+                  f"p99 {delta(lat['p99'], old['latency']['p99'])}")
+
+
+async def run(args) -> Dict:
+    data = Path(args.file).read_bytes()
+    results = []
+    async with httpx.AsyncClient(timeout=None) as client:
+        await wait_ready(client, f"{args.url}/docs")
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                # One untimed request so process-pool start-up is not charged to the first level
+                await client.post(f"{args.url}/extract", files={"file": (Path(args.file).name, data)},
+                                  data={"mode": mode, "model_ocr": args.model, "model_llm": args.model})
+                results.append(await run_level(client, args, data, mode, concurrency))
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "file": Path(args.file).name,
+        "stub_latency_ms": args.stub_latency_ms if args.spawn else None,
+        "warm": args.warm,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file")
+    parser.add_argument("--modes", nargs="+", default=["llm", "ocr", "both"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="requests per (mode, concurrency) level")
+    parser.add_argument("--model", default="google/gemini-2.5-flash")
+    parser.add_argument("--url", help="benchmark an already running app instead of spawning one")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--stub-latency-ms", type=float, default=800)
+    parser.add_argument("--stub-error-rate", type=float, default=0)
+    parser.add_argument("--warm", action="store_true", help="keep the result and raster caches enabled")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="JSON from an earlier run to diff against")
+    args = parser.parse_args()
+    args.spawn = args.url is None
+    args.url = args.url or f"http://127.0.0.1:{args.app_port}"
+
+    if args.spawn:
+        with servers(args):
+            report = asyncio.run(run(args))
+    else:
+        report = asyncio.run(run(args))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_results(report["results"], baseline)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"\nResults saved to {args.out}")
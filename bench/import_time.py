@@ -0,0 +1,61 @@
+"""
+Import-time budget for the app.
+
+Imports `app.main` in fresh interpreters, reports the median wall time and the
+slowest modules (from -X importtime), and fails if the median exceeds the budget
+or if a module that should load lazily was imported:
+
+    python -m bench.import_time --budget-ms 700
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Must not be imported until a request (or APP_PREWARM) needs them
+DEFERRED = ("fitz", "pymupdf", "PIL.Image", "pytesseract", "pandas", "numpy", "json_repair")
+
+PROBE = (
+    "import sys, time; t = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - t); print(','.join(m for m in {deferred!r} if m in sys.modules))"
+)
+
+
+def measure(module: str) -> tuple:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, deferred=DEFERRED)],
+                         capture_output=True, text=True, check=True)
+    seconds, loaded = out.stdout.splitlines()[:2]
+    modules = []
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                modules.append((int(cumulative), name.rstrip()))
+    return float(seconds), [m for m in loaded.split(",") if m], modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=700)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    results = [measure(args.module) for _ in range(args.runs)]
+    median_ms = statistics.median(r[0] for r in results) * 1000
+    loaded = results[-1][1]
+
+    print(f"import {args.module}: median {median_ms:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    print("\nslowest modules (cumulative, last run):")
+    for us, name in sorted(results[-1][2], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"\nFAIL: imported eagerly: {', '.join(loaded)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"\nFAIL: over budget by {median_ms - args.budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
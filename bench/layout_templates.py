@@ -0,0 +1,99 @@
+"""
+Build and evaluate the invoice layout templates used for region-of-interest OCR.
+
+learn: average the thumbnail signature of sample first pages of one invoice style and save
+it with the regions to OCR (fractions of the page: x0,y0,x1,y1), e.g. the header and the
+goods table:
+
+    python -m bench.layout_templates learn --name style1 --samples test_images/Invoice_Style1_*.pdf \\
+        --region 0,0,1,0.35 --region 0,0.45,1,0.8 --out layouts.json
+
+evaluate: OCR every page of the ground-truth documents in full and with the templates, and
+report the layout hit rate, Tesseract time, OCR text size (what the LLM is sent) and how many
+ground-truth values are still found in the text:
+
+    python -m bench.layout_templates evaluate --images test_images --layouts layouts.json
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from app.services.document import Document
+from app.services.layouts import Layout, load_layouts, match_layout, recognize_page, signature
+from app.services.raster import render_pages
+from bench.ocr_profiles import value_recall
+from tests import GROUND_TRUTH
+
+
+def page_images(path: str, first_only: bool = False):
+    doc = Document.from_path(path)
+    with doc.open_pdf() as pdf:
+        n = 1 if first_only else pdf.page_count
+    return [r.to_image() for r in render_pages(doc.data, list(range(n)))]
+
+
+def learn(args) -> None:
+    samples = [page_images(path, first_only=True)[0] for path in args.samples]
+    sigs = [signature(img) for img in samples]
+    layout = Layout(
+        name=args.name,
+        aspect=sum(img.height / img.width for img in samples) / len(samples),
+        signature=[round(sum(column) / len(column), 1) for column in zip(*sigs)],
+        regions=[tuple(float(v) for v in region.split(",")) for region in args.region],
+    )
+    data = {"layouts": []}
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            data = json.load(f)
+    data["layouts"] = [d for d in data["layouts"] if d["name"] != args.name] + [layout._asdict()]
+    with open(args.out, "w") as f:
+        json.dump(data, f)
+    print(f"{args.name}: {len(samples)} samples, {len(layout.regions)} regions -> {args.out}")
+
+
+def evaluate(args) -> None:
+    layouts = load_layouts(args.layouts)
+    paths = [p for p in sorted(Path(args.images).iterdir()) if p.name in GROUND_TRUTH]
+    if not paths:
+        raise SystemExit(f"No ground-truth documents found in {args.images}")
+    totals = {"full": [0.0, 0, 0, 0], "roi": [0.0, 0, 0, 0]}  # seconds, chars, values found, values
+    pages = matched = 0
+    for path in paths:
+        images = page_images(str(path))
+        texts = {}
+        for kind, candidates in (("full", []), ("roi", layouts)):
+            start = time.perf_counter()
+            results = [recognize_page(img, args.profile, layouts=candidates) for img in images]
+            totals[kind][0] += time.perf_counter() - start
+            texts[kind] = "\n".join(r.text for r in results)
+            totals[kind][1] += len(texts[kind])
+            found, total = value_recall(texts[kind], GROUND_TRUTH[path.name])
+            totals[kind][2] += found
+            totals[kind][3] += total
+        hits = [match_layout(img, layouts) for img in images]
+        pages += len(images)
+        matched += sum(h is not None for h in hits)
+        print(f"{path.name:<28} {', '.join(h.name if h else '-' for h in hits)}")
+
+    print(f"\n{matched}/{pages} pages matched a layout ({matched / pages * 100:.0f}%)")
+    print(f"{'':<5} {'OCR s':>7} {'text chars':>11} {'recall %':>9}")
+    for kind, (seconds, chars, found, total) in totals.items():
+        print(f"{kind:<5} {seconds:>7.2f} {chars:>11} {found / max(1, total) * 100:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("learn")
+    p.add_argument("--name", required=True)
+    p.add_argument("--samples", nargs="+", required=True)
+    p.add_argument("--region", action="append", required=True, help="x0,y0,x1,y1 as page fractions")
+    p.add_argument("--out", default="layouts.json")
+    p = sub.add_parser("evaluate")
+    p.add_argument("--images", default="test_images")
+    p.add_argument("--layouts", default="layouts.json")
+    p.add_argument("--profile", help="OCR profile (default: OCR_PROFILE)")
+    args = parser.parse_args()
+    learn(args) if args.command == "learn" else evaluate(args)
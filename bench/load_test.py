@@ -0,0 +1,62 @@
+"""
+Concurrency load test for /extract.
+
+Start the stub and the app (see bench/openrouter_stub.py), then:
+
+    python -m bench.load_test invoice.pdf --requests 50 --concurrency 25 --mode llm
+
+Each request sends slightly different bytes (a trailing comment), so the app neither serves
+repeats from its result cache nor coalesces concurrent requests into one upstream call;
+pass --identical to measure those.
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+import httpx
+
+
+async def run(args) -> None:
+    data = Path(args.file).read_bytes()
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        async def one(i: int):
+            body = data if args.identical else data + f"\n% load test request {i}\n".encode()
+            async with sem:
+                start = time.perf_counter()
+                resp = await client.post(
+                    f"{args.url}/extract",
+                    files={"file": (Path(args.file).name, body)},
+                    data={"mode": args.mode},
+                )
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        stats = (await client.get(f"{args.stub_url}/stats")).json() if args.stub_url else {}
+
+    print(f"requests:        {args.requests}")
+    print(f"concurrency:     {args.concurrency}")
+    print(f"wall time:       {elapsed:.2f}s")
+    print(f"throughput:      {args.requests / elapsed:.2f} req/s")
+    print(f"mean latency:    {sum(latencies) / len(latencies):.2f}s")
+    if stats:
+        print(f"upstream max in flight: {stats['max_in_flight']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--stub-url", default="http://127.0.0.1:9000")
+    parser.add_argument("--mode", default="llm")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=25)
+    parser.add_argument("--identical", action="store_true", help="send the same bytes in every request")
+    asyncio.run(run(parser.parse_args()))
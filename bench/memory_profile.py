@@ -0,0 +1,120 @@
+"""
+Peak memory of OCR and vision-page preparation on a large scanned PDF, per page memory budget.
+
+Builds a synthetic image-only PDF (A3 pages, so every page needs OCR) unless --pdf is given,
+then runs each configuration in a fresh interpreter and reports the peak RSS of the app
+process and of the largest pool worker. "unbounded" renders every page at once and keeps
+all of them in the raster cache, which is how pages were handled before budgets.
+
+    python -m bench.memory_profile --pages 100 --budgets unbounded 268435456 67108864
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+UNBOUNDED = 1 << 50
+
+
+def make_scan_pdf(path: str, pages: int, dpi: int = 150) -> None:
+    """Image-only A3 pages that look like greyscale scans: text lines, a table grid and noise."""
+    import fitz
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(0)
+    width, height = int(11.69 * dpi), int(16.54 * dpi)
+    with fitz.open() as pdf:
+        for n in range(pages):
+            img = Image.effect_noise((width, height), 12).point(lambda v: 235 + v // 12)
+            draw = ImageDraw.Draw(img)
+            for row in range(60):
+                y = 80 + row * (height - 160) // 60
+                draw.line((60, y, width - 60, y), fill=120)
+                draw.text((80, y + 6), f"Item {n}-{row}  HS {rng.randint(1000, 9999)}.{rng.randint(10, 99)}  "
+                                       f"qty {rng.randint(1, 500)}", fill=20)
+            page = pdf.new_page(width=842, height=1191)
+            page.insert_image(page.rect, stream=_jpeg(img))
+        pdf.save(path)
+
+
+def _jpeg(img) -> bytes:
+    import io
+
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=60)
+    return buf.getvalue()
+
+
+def child(args) -> None:
+    """One measurement, in its own process so peak RSS is not shared between runs."""
+    from app.services import ocr_pool
+    from app.services.document import Document
+    from app.services.llm_extraction import prepare_pdf_pages
+    from app.services.ocr_service import ocr_pages_async
+
+    doc = Document.from_path(args.pdf)
+
+    async def run():
+        await ocr_pool.warm(args.workers)
+        start = time.perf_counter()
+        if args.mode == "ocr":
+            out = len(await ocr_pages_async(doc))
+        else:
+            out = len(await prepare_pdf_pages(doc, "google/gemini-2.5-flash"))
+        return out, time.perf_counter() - start
+
+    pages, seconds = asyncio.run(run())
+    ocr_pool.get_pool().shutdown(wait=True)  # workers must exit for their peak RSS to be reported
+    print(json.dumps({
+        "pages": pages,
+        "seconds": seconds,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+
+def measure(pdf: str, mode: str, budget: int, workers: int) -> dict:
+    env = {**os.environ, "PAGE_MEMORY_BUDGET": str(budget), "OCR_WORKERS": str(workers)}
+    if budget == UNBOUNDED:
+        env["RASTER_CACHE_BYTES"] = str(UNBOUNDED)
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.memory_profile", "--child", "--pdf", pdf, "--mode", mode,
+         "--workers", str(workers)],
+        env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = args.pdf
+        if pdf is None:
+            pdf = os.path.join(tmp, "scan.pdf")
+            make_scan_pdf(pdf, args.pages)
+        print(f"{pdf}: {os.path.getsize(pdf) / 1e6:.1f} MB, {args.workers} workers")
+        print(f"{'mode':<5} {'budget':>10} {'pages':>6} {'seconds':>8} {'peak RSS MB':>12} {'worker MB':>10}")
+        for mode in args.modes:
+            for budget in args.budgets:
+                b = UNBOUNDED if budget == "unbounded" else int(budget)
+                row = measure(pdf, mode, b, args.workers)
+                label = "unbounded" if b == UNBOUNDED else f"{b // (1024 * 1024)} MB"
+                print(f"{mode:<5} {label:>10} {row['pages']:>6} {row['seconds']:>8.1f} "
+                      f"{row['rss_mb']:>12.0f} {row['worker_rss_mb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="scanned PDF to use instead of a generated one")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--modes", nargs="+", default=["ocr", "llm"], choices=["ocr", "llm"])
+    parser.add_argument("--budgets", nargs="+", default=["unbounded", str(256 * 1024 * 1024), str(64 * 1024 * 1024)])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="ocr", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    child(args) if args.child else main(args)
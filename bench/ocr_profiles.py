@@ -0,0 +1,110 @@
+"""
+OCR profile comparison over the test_images corpus: pages/sec and field accuracy.
+
+Every page is OCR'd (the text layer is ignored) with each profile on the process pool.
+Accuracy is the share of ground-truth values (from tests.py) found in the OCR text;
+with --model the text is also structured by that model and scored field by field
+like tests.py does (needs OpenRouter or the stub).
+
+    python -m bench.ocr_profiles --images test_images --profiles baseline gray fast binarize
+    OCR_ENGINE=pytesseract python -m bench.ocr_profiles --model google/gemini-2.5-flash
+"""
+import argparse
+import asyncio
+import os
+import re
+import time
+from pathlib import Path
+
+from app.services.document import Document
+from app.services.ocr_engine import OCR_ENGINE, PROFILES, _has_tesserocr
+from app.services.ocr_pool import OCR_WORKERS, make_pool, ocr_rasters
+from app.services.raster import count_pages, get_rasters
+from tests import GROUND_TRUTH, compare_dicts
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def leaf_values(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for v in value:
+            yield from leaf_values(v)
+    elif value is not None:
+        yield str(value)
+
+
+def value_recall(text: str, truth: dict) -> tuple:
+    """How many non-null ground-truth values appear verbatim (case/space-insensitive) in the text."""
+    values = list(leaf_values(truth))
+    haystack = normalize(text)
+    return sum(normalize(v) in haystack for v in values), len(values)
+
+
+async def run_profile(docs, rasters, pool, profile: str, model: str | None) -> dict:
+    start = time.perf_counter()
+    texts = {}
+    for doc in docs:
+        pages = await ocr_rasters(rasters[doc.filename], executor=pool, profile=profile)
+        texts[doc.filename] = pages
+    elapsed = time.perf_counter() - start
+
+    found = total = 0
+    for name, pages in texts.items():
+        f, t = value_recall("\n".join(pages), GROUND_TRUTH[name])
+        found, total = found + f, total + t
+    row = {"seconds": elapsed, "recall": found / total * 100 if total else 0.0}
+
+    if model:
+        from app.services.ocr_service import structure_pages_async
+
+        correct = fields = 0
+        for name, pages in texts.items():
+            pred, _ = await structure_pages_async(pages, model)
+            c, t = compare_dicts(pred if "error" not in pred else {}, GROUND_TRUTH[name])
+            correct, fields = correct + c, fields + t
+        row["field_accuracy"] = correct / fields * 100 if fields else 0.0
+    return row
+
+
+async def main(args) -> None:
+    docs = [Document.from_path(str(p)) for p in sorted(Path(args.images).iterdir())
+            if p.suffix.lower() == ".pdf" and p.name in GROUND_TRUTH]
+    if not docs:
+        raise SystemExit(f"No ground-truth PDFs found in {args.images}")
+    total_pages = sum(count_pages(doc) for doc in docs)
+    engine = "tesserocr" if OCR_ENGINE == "tesserocr" or (OCR_ENGINE == "auto" and _has_tesserocr()) else "pytesseract"
+    print(f"{len(docs)} documents, {total_pages} pages, engine {engine}, {args.workers} workers")
+
+    with make_pool(args.workers) as pool:
+        # Render once; every profile starts from the same shared rasters
+        rasters = {doc.filename: await get_rasters(doc, list(range(count_pages(doc))), executor=pool,
+                                                   workers=args.workers) for doc in docs}
+        await ocr_rasters(rasters[docs[0].filename][:1], executor=pool)  # start the workers
+
+        print(f"{'profile':<10} {'dpi':>4} {'psm':>4} {'oem':>4} {'prep':>9} {'pages/sec':>10} {'recall %':>9}"
+              + (f" {'fields %':>9}" if args.model else ""))
+        for name in args.profiles:
+            p = PROFILES[name]
+            row = await run_profile(docs, rasters, pool, name, args.model)
+            line = (f"{name:<10} {p.dpi:>4} {p.psm:>4} {p.oem:>4} {p.preprocess:>9} "
+                    f"{total_pages / row['seconds']:>10.2f} {row['recall']:>9.1f}")
+            if args.model:
+                line += f" {row['field_accuracy']:>9.1f}"
+            print(line)
+
+    if args.model:
+        from app.services import openrouter
+        await openrouter.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="test_images")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--workers", type=int, default=OCR_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--model", help="also structure the OCR text with this model and score the fields")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+"""
+OCR throughput vs. number of worker processes over the test_images corpus.
+
+    python -m bench.ocr_scaling --images test_images --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from app.services.document import Document
+from app.services.ocr_pool import make_pool, ocr_rasters
+from app.services.raster import count_pages, get_rasters, raster_cache
+
+
+async def ocr_corpus(docs, pool, workers: int) -> None:
+    for doc in docs:
+        rasters = await get_rasters(doc, list(range(count_pages(doc))), executor=pool, workers=workers)
+        await ocr_rasters(rasters, executor=pool)
+
+
+def main(args) -> None:
+    docs = [Document.from_path(str(p)) for p in sorted(Path(args.images).iterdir()) if p.suffix.lower() == ".pdf"]
+    if not docs:
+        raise SystemExit(f"No PDFs found in {args.images}")
+    total_pages = sum(count_pages(doc) for doc in docs)
+
+    print(f"{len(docs)} documents, {total_pages} pages")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/sec':>10} {'speedup':>8}")
+
+    baseline = None
+    for workers in args.workers:
+        with make_pool(workers) as pool:
+            # Warm up worker processes so spawn cost is not measured
+            list(pool.map(abs, range(workers)))
+            # Measure full render + OCR, not cache hits from the previous round
+            raster_cache.clear()
+
+            start = time.perf_counter()
+            asyncio.run(ocr_corpus(docs, pool, workers))
+            elapsed = time.perf_counter() - start
+
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {total_pages / elapsed:>10.2f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="test_images")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    main(parser.parse_args())
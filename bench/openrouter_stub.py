@@ -0,0 +1,146 @@
+"""
+Local stand-in for the OpenRouter chat-completions endpoint.
+
+Run it and point the app at it:
+
+    STUB_LATENCY_MS=800 uvicorn bench.openrouter_stub:app --port 9000
+    OPENROUTER_BASE_URL=http://127.0.0.1:9000/api/v1 uvicorn app.main:app
+
+Set STUB_ERROR_RATE to fail that fraction of calls with STUB_ERROR_STATUS
+(and a Retry-After header when STUB_RETRY_AFTER is set) to exercise retries.
+
+STUB_SLOW_RATE of calls take STUB_SLOW_MS instead, to give latency a long tail.
+
+Models listed in STUB_WEAK_MODELS answer without an HS code, which makes the
+model cascade (model "auto") escalate.
+
+Prompt tokens are estimated from the request (4 characters per token, 258 per image);
+text parts marked with cache_control are reported as cached_tokens from the second
+time the stub sees them. A json_schema response_format gets bare JSON, no fences.
+
+Requests with "stream": true get server-sent events: the first chunk after
+STUB_TTFT_FRACTION of the latency, the rest of the answer spread over the remainder.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "500"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "429"))
+STUB_RETRY_AFTER = os.getenv("STUB_RETRY_AFTER")
+STUB_TTFT_FRACTION = float(os.getenv("STUB_TTFT_FRACTION", "0.25"))
+STUB_STREAM_CHUNKS = int(os.getenv("STUB_STREAM_CHUNKS", "40"))
+STUB_SLOW_RATE = float(os.getenv("STUB_SLOW_RATE", "0"))
+STUB_SLOW_MS = float(os.getenv("STUB_SLOW_MS", "5000"))
+STUB_WEAK_MODELS = set(filter(None, os.getenv("STUB_WEAK_MODELS", "").split(",")))
+
+CANNED_RESULT = {
+    "Parties": [
+        {"PartyName": "Fresh Harvest Exports", "Role": "Exporter", "Location": {"City": "Nashik", "Country": "India"}},
+        {"PartyName": "Pacific Seafood Imports", "Role": "Consignee", "Location": {"City": "Tokyo", "Country": "Japan"}},
+    ],
+    "CountryOverview": {"CountryOfOrigin": "India", "CountryOfDestination": None, "TransitCountry": None},
+    "CommodityDetails": [{"DescriptionOfGoods": "Cotton T-Shirts", "HSCode": "6109.10"}],
+    "Transportation": {"MeansOfTransport": None, "VesselNumber": None},
+}
+
+app = FastAPI(title="OpenRouter stub")
+app.state.in_flight = 0
+app.state.max_in_flight = 0
+app.state.requests = 0
+app.state.errors = 0
+app.state.cached_prefixes = set()
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests += 1
+    if random.random() < STUB_ERROR_RATE:
+        app.state.errors += 1
+        headers = {"Retry-After": STUB_RETRY_AFTER} if STUB_RETRY_AFTER else {}
+        return JSONResponse({"error": {"message": "stub error"}}, status_code=STUB_ERROR_STATUS, headers=headers)
+
+    result = CANNED_RESULT
+    if body.get("model") in STUB_WEAK_MODELS:
+        result = {**CANNED_RESULT, "CommodityDetails": [{"DescriptionOfGoods": "Cotton T-Shirts", "HSCode": None}]}
+    content = json.dumps(result)
+    if (body.get("response_format") or {}).get("type") != "json_schema":
+        content = "```json\n" + content + "\n```"
+    usage = usage_for(body)
+    if body.get("stream"):
+        return StreamingResponse(stream_content(body.get("model"), content, usage), media_type="text/event-stream")
+
+    app.state.in_flight += 1
+    app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+    try:
+        await asyncio.sleep(latency_ms() / 1000)
+    finally:
+        app.state.in_flight -= 1
+
+    return {
+        "id": "stub",
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": usage,
+    }
+
+
+def latency_ms() -> float:
+    return STUB_SLOW_MS if random.random() < STUB_SLOW_RATE else STUB_LATENCY_MS
+
+
+def usage_for(body: dict) -> dict:
+    prompt_tokens = cached = 0
+    for message in body.get("messages") or []:
+        parts = message.get("content")
+        for part in [{"type": "text", "text": parts}] if isinstance(parts, str) else parts or []:
+            if part.get("type") != "text":
+                prompt_tokens += 258
+                continue
+            tokens = -(-len(part.get("text") or "") // 4)
+            prompt_tokens += tokens
+            if part.get("cache_control"):
+                digest = hashlib.sha256(part["text"].encode("utf-8")).hexdigest()
+                if digest in app.state.cached_prefixes:
+                    cached += tokens
+                app.state.cached_prefixes.add(digest)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": 200, "total_tokens": prompt_tokens + 200,
+            "prompt_tokens_details": {"cached_tokens": cached}}
+
+
+async def stream_content(model, content: str, usage: dict):
+    app.state.in_flight += 1
+    app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+    try:
+        latency = latency_ms() / 1000
+        await asyncio.sleep(latency * STUB_TTFT_FRACTION)
+        size = -(-len(content) // STUB_STREAM_CHUNKS)
+        for i in range(0, len(content), size):
+            if i:
+                await asyncio.sleep(latency * (1 - STUB_TTFT_FRACTION) / STUB_STREAM_CHUNKS)
+            chunk = {"id": "stub", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + size]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {"id": "stub", "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                 "usage": usage}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        app.state.in_flight -= 1
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "requests": app.state.requests,
+        "errors": app.state.errors,
+        "in_flight": app.state.in_flight,
+        "max_in_flight": app.state.max_in_flight,
+    }
@@ -0,0 +1,103 @@
+"""
+Perceptual-hash near-duplicate detection: robustness and index scale.
+
+1. For each document's first page, the Hamming distance to the same page rendered at a
+   lower DPI, recompressed as a low-quality JPEG, and degraded like a fax (blur, threshold,
+   slight skew), versus the distance between different documents. Pick PHASH_MAX_DISTANCE
+   above the first group and well below the second.
+2. Insert N random hashes into an on-disk index and time lookups against it.
+
+    python -m bench.phash_index --images test_images --entries 1000000
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageFilter
+
+from app.services.document import Document
+from app.services.phash import HASH_BITS, PHASH_MAX_DISTANCE, PHashIndex, distance, phash
+
+
+def render(doc: Document, dpi: int) -> Image.Image:
+    with doc.open_pdf() as pdf:
+        pix = pdf[0].get_pixmap(dpi=dpi)
+        return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+
+def variants(page: Image.Image, doc: Document) -> dict:
+    buf = io.BytesIO()
+    page.convert("L").save(buf, "JPEG", quality=25)
+    fax = (page.convert("L").filter(ImageFilter.GaussianBlur(1))
+           .point(lambda v: 255 if v > 150 else 0).rotate(0.5, fillcolor=255))
+    return {"150dpi": render(doc, 150), "jpeg q25": Image.open(buf), "fax": fax}
+
+
+def robustness(images: str) -> None:
+    docs = [Document.from_path(str(p)) for p in sorted(Path(images).iterdir()) if p.suffix.lower() == ".pdf"]
+    if not docs:
+        raise SystemExit(f"No PDFs found in {images}")
+    hashes, same = [], {}
+    for doc in docs:
+        page = render(doc, 300)
+        start = time.perf_counter()
+        h = phash(page)
+        hash_ms = (time.perf_counter() - start) * 1000
+        hashes.append((doc.sha256, h))
+        for name, img in variants(page, doc).items():
+            same.setdefault(name, []).append(distance(h, phash(img)))
+    print(f"{len(docs)} documents, {HASH_BITS}-bit hash, {hash_ms:.1f} ms to hash a 300 DPI page, "
+          f"threshold {PHASH_MAX_DISTANCE}")
+    for name, ds in same.items():
+        print(f"  same document, {name:<9} max {max(ds):>3}  mean {statistics.mean(ds):>5.1f}")
+    different = [distance(a, b) for i, (sa, a) in enumerate(hashes) for sb, b in hashes[i + 1:] if sa != sb]
+    if different:
+        print(f"  different documents     min {min(different):>3}  p1 "
+              f"{sorted(different)[len(different) // 100]:>3}  pairs {len(different)}")
+
+
+def scale(entries: int, lookups: int) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PHashIndex(os.path.join(tmp, "index.sqlite3"))
+        start = time.perf_counter()
+        batch = []
+        for i in range(entries):
+            batch.append(("ctx", rng.getrandbits(HASH_BITS), f"key{i}"))
+            if len(batch) == 10000:
+                index.add_many(batch)
+                batch = []
+        index.add_many(batch)
+        insert_s = time.perf_counter() - start
+
+        probes = [rng.getrandbits(HASH_BITS) for _ in range(lookups)]
+        # Near copies of indexed hashes must be found
+        known = "ctx", rng.getrandbits(HASH_BITS), "known"
+        index.add(*known)
+        noisy = known[1] ^ sum(1 << b for b in rng.sample(range(HASH_BITS), PHASH_MAX_DISTANCE))
+        assert index.nearest("ctx", noisy) == ("known", PHASH_MAX_DISTANCE)
+
+        times = []
+        for probe in probes:
+            start = time.perf_counter()
+            index.nearest("ctx", probe)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        size_mb = os.path.getsize(os.path.join(tmp, "index.sqlite3")) / 1e6
+    print(f"{entries} entries: insert {entries / insert_s:.0f}/s, {size_mb:.0f} MB on disk, "
+          f"lookup p50 {times[len(times) // 2] * 1000:.2f} ms  p99 {times[int(len(times) * 0.99)] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="test_images")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+    robustness(args.images)
+    scale(args.entries, args.lookups)
@@ -0,0 +1,75 @@
+"""
+Compare prompt template variants on the OCR-text path: input tokens, prompt-cache reads,
+latency and field accuracy against the ground truth in tests.py.
+
+Each document's text is extracted once, then structured with every variant `--repeat`
+times, so later calls can hit the provider's prompt cache. Runs against OpenRouter,
+or the stub via OPENROUTER_BASE_URL (which estimates tokens from the request).
+
+    python -m bench.prompt_variants --model anthropic/claude-3.5-haiku --repeat 3
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+from app.prompt.templates import TEMPLATES
+from app.services import openrouter
+from app.services.document import Document
+from app.services.llm_extraction import complete_structured
+from app.services.ocr_service import ocr_pages_async
+from tests import GROUND_TRUTH, compare_dicts
+
+
+async def run_variant(texts: dict, model: str, variant: str, repeat: int) -> dict:
+    prompt_tokens, cached_tokens, latencies = [], [], []
+    correct = total = 0
+    for _ in range(repeat):
+        for name, text in texts.items():
+            start = time.perf_counter()
+            pred, usage = await complete_structured(model, [{"type": "text", "text": "Document text:" + text}],
+                                                    variant=variant)
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(usage.get("prompt_tokens") or 0)
+            cached_tokens.append(usage.get("cached_tokens") or 0)
+            c, t = compare_dicts(pred, GROUND_TRUTH[name])
+            correct, total = correct + c, total + t
+    return {
+        "prompt_tokens": statistics.mean(prompt_tokens),
+        "cached_pct": sum(cached_tokens) / max(1, sum(prompt_tokens)) * 100,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "accuracy": correct / total * 100 if total else 0.0,
+    }
+
+
+async def main(args) -> None:
+    paths = [p for p in sorted(Path(args.images).iterdir()) if p.name in GROUND_TRUTH][:args.limit]
+    if not paths:
+        raise SystemExit(f"No ground-truth documents found in {args.images}")
+    texts = {}
+    for path in paths:
+        pages = await ocr_pages_async(Document.from_path(str(path)))
+        texts[path.name] = "\n".join(pages).strip()
+    print(f"{len(texts)} documents, model {args.model}, {args.repeat} passes")
+
+    print(f"{'variant':<10} {'version':>7} {'prefix chars':>12} {'prompt tok':>11} {'cached %':>9} "
+          f"{'p50 ms':>8} {'fields %':>9}")
+    try:
+        for variant in args.variants:
+            row = await run_variant(texts, args.model, variant, args.repeat)
+            template = TEMPLATES[variant]
+            print(f"{variant:<10} {template.version:>7} {len(template.text):>12} {row['prompt_tokens']:>11.0f} "
+                  f"{row['cached_pct']:>9.1f} {row['p50_ms']:>8.0f} {row['accuracy']:>9.1f}")
+    finally:
+        await openrouter.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="test_images")
+    parser.add_argument("--model", default="google/gemini-2.5-flash")
+    parser.add_argument("--variants", nargs="+", default=list(TEMPLATES), choices=list(TEMPLATES))
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=10, help="documents to use")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,27 @@
+import pytest
+
+from app.services.parsing import IncrementalJSONParser, parse_repaired, parse_structured_data
+
+
+@pytest.mark.parametrize("text", [
+    "{'Parties': [1], 'X': 2}",
+    '{Parties: [1]}',
+    '{"a": 1 "b": 2}',
+    '[{"a":1},{"b":2}]',
+])
+def test_malformed_output_is_repaired(text):
+    assert parse_structured_data(text) == parse_repaired(text)
+    assert parse_structured_data(text) != {}
+
+
+def test_fields_stream_as_they_complete():
+    parser = IncrementalJSONParser()
+    fields = [field for c in '```json\n{"a": [1, "x:,]"], "b": {"c": null}}\n```' for field in parser.feed(c)]
+    assert fields == [("a", [1, "x:,]"]), ("b", {"c": None})]
+    assert parser.finish() == {"a": [1, "x:,]"], "b": {"c": None}}
+
+
+def test_malformed_field_stops_streaming():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"a": 1 "b": 2, "c": 3}') == []
+    assert parser.finish() == {"a": 1, "b": 2, "c": 3}
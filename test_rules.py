@@ -0,0 +1,27 @@
+from app.services.rules import extract_rules
+
+
+def test_street_line_is_not_a_location():
+    text = "Exporter: ABC Textiles Pvt. Ltd.\nPlot 12, MIDC Andheri\nMumbai, India\n" \
+           "Consignee: Global Apparel Inc.\nNew York, USA\n"
+    parties = extract_rules(text).fields["Parties"]
+    assert parties[0]["Location"] == {"City": "Mumbai", "Country": "India"}
+
+
+def test_unknown_location_is_left_to_the_llm():
+    text = "Exporter: ABC Textiles Pvt. Ltd.\nPlot 12, MIDC Andheri\n" \
+           "Consignee: Global Apparel Inc.\nNew York, USA\n"
+    assert "Parties" not in extract_rules(text).fields
+
+
+def test_names_keep_their_final_period():
+    text = "Exporter: TechnoMach Tools Pvt. Ltd.;\nPune, India\nConsignee: Precision Engineering Co.\nStuttgart, Germany\n"
+    names = [p["PartyName"] for p in extract_rules(text).fields["Parties"]]
+    assert names == ["TechnoMach Tools Pvt. Ltd.", "Precision Engineering Co."]
+
+
+def test_description_stops_before_hs_code():
+    for line in ("Goods: Cotton T-Shirts  HS Code: 6109.10", "Goods: Cotton T-Shirts HS Code: 6109.10",
+                 "Goods: Cotton T-Shirts\tQty: 500\nHS Code: 6109.10"):
+        found = extract_rules(line)
+        assert found.fields["CommodityDetails"] == [{"DescriptionOfGoods": "Cotton T-Shirts", "HSCode": "6109.10"}]
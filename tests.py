@@ -1,29 +1,16 @@
+import argparse
+import asyncio
 import csv
 import json
 import time
 from typing import Dict, List
 
-import pandas as pd
 from pathlib import Path
-from app.services.ocr_service import ocr_and_structure
-from app.services.llm_extraction import llm_extract
 from dotenv import load_dotenv
 
-load_dotenv()
-IMAGE_DIR = Path("test_images")
-
-# Pricing dict (USD per milion tokens token)
-TOKEN_PRICES = {
-    "openai/gpt-4o-mini": {"prompt": 0.15, "completion": 0.6},
-    "google/gemini-2.5-flash": {"prompt": 0.3, "completion": 2.5},
-    "google/gemini-2.0-flash-lite-001": {"prompt": 0.075, "completion": 0.3},
-    "google/gemini-2.5-flash-lite": {"prompt": 0.1, "completion": 0.4},
-    "meta-llama/llama-3.2-11b-vision-instruct": {"prompt": 0.049, "completion": 0.049},
-    "anthropic/claude-3.5-haiku": {"prompt": 0.8, "completion": 4},
-    "qwen/qwen-2.5-vl-7b-instruct": {"prompt": 0.2, "completion": 0.2},
-
-}
+from app.services.pricing import TOKEN_PRICES, usage_cost
 
+load_dotenv()
 IMAGE_DIR = Path("test_images")
 
 # Ground truth JSON for each image
@@ -296,85 +283,171 @@ def flatten_dict(d):
         else:
             yield v
 
-def calculate_price(model: str, prompt_tokens: int, completion_tokens: int) -> float:
-    if model not in TOKEN_PRICES:
-        return 0
-    pricing = TOKEN_PRICES[model]
-    return (prompt_tokens / 1000000 * pricing["prompt"]) + \
-           (completion_tokens / 1000000 * pricing["completion"])
+def score_record(record: dict) -> dict:
+    """Turn a checkpointed (file, method, model) result into a report row."""
+    truth = GROUND_TRUTH[record["file"]]
+    pred = record.get("prediction") or {}
+    usage = record.get("usage") or {}
+
+    correct, total = compare_dicts(pred, truth)
+    accuracy = correct / total * 100 if total else 0
+
+    tokens_prompt = usage.get("prompt_tokens", 0)
+    tokens_completion = usage.get("completion_tokens", 0)
+    # Routed extractions report the summed cost of every model they tried
+    price = usage["cost"] if "cost" in usage else usage_cost(record["model"], usage)
+    image_prep = usage.get("image_prep") or {}
 
-def test_pipeline(models: Dict[str, List[str]], report_path, mode: str = "boolean"):
+    return {
+        "file": record["file"],
+        "method": record["method"],
+        "model": record["model"],
+        "image_profile": record.get("image_profile"),
+        "image_bytes": image_prep.get("bytes"),
+        "est_image_tokens_saved": image_prep.get("est_tokens_saved"),
+        "accuracy": accuracy,
+        "correct": correct,
+        "total": total,
+        "time_sec": record["time_sec"],
+        "prompt_tokens": tokens_prompt,
+        "completion_tokens": tokens_completion,
+        "total_tokens": tokens_prompt + tokens_completion,
+        "price_usd": price,
+        # 0 when the rules settled every field
+        "llm_calls": usage.get("llm_calls", usage.get("windows", 1)),
+    }
 
-    report_rows = []
 
-    for img_file in IMAGE_DIR.iterdir():
-        if img_file.suffix.lower() not in [".jpg", ".jpeg", ".png", ".pdf"]:
-            continue
+def checkpoint_key(file: str, method: str, model: str, image_profile: str | None) -> tuple:
+    """Identity of a result in the checkpoint; the image profile only changes what vision calls see."""
+    return file, method, model, image_profile if method == "llm" else None
 
-        print(f"Processing {img_file.name}...")
-        truth = GROUND_TRUTH.get(img_file.name)
-        if not truth:
-            print(f"No ground truth for {img_file.name}, skipping.\n")
-            continue
 
-        # OCR models
-        for model in models.get("ocr", []):
+def load_checkpoint(checkpoint_path) -> Dict[tuple, dict]:
+    """Completed results keyed by checkpoint_key; later lines win."""
+    records = {}
+    path = Path(checkpoint_path)
+    if not path.exists():
+        return records
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
             try:
-                start_time = time.time()
-                ocr_pred, usage = ocr_and_structure(str(img_file), model=model)
-                elapsed = time.time() - start_time
-
-                correct, total = compare_dicts(ocr_pred, truth)
-                accuracy = correct / total * 100 if total else 0
-
-                tokens_prompt = usage.get("prompt_tokens", 0)
-                tokens_completion = usage.get("completion_tokens", 0)
-                price = calculate_price(model, tokens_prompt, tokens_completion)
-
-                report_rows.append({
-                    "file": img_file.name,
-                    "method": "ocr",
-                    "model": model,
-                    "accuracy": accuracy,
-                    "correct": correct,
-                    "total": total,
-                    "time_sec": elapsed,
-                    "prompt_tokens": tokens_prompt,
-                    "completion_tokens": tokens_completion,
-                    "total_tokens": tokens_prompt + tokens_completion,
-                    "price_usd": price
-                })
-            except Exception as e:
-                print(f"OCR ({model}) failed for {img_file.name}: {e}")
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line of an interrupted run
+            key = checkpoint_key(record["file"], record["method"], record["model"], record.get("image_profile"))
+            records[key] = record
+    return records
+
+
+class RateLimiter:
+    """Per-model limit on concurrent calls and on calls per minute."""
+
+    def __init__(self, concurrency: int, per_minute: float = 0):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 60 / per_minute if per_minute else 0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval:
+            async with self.lock:
+                now = time.monotonic()
+                wait = self.next_slot - now
+                self.next_slot = max(now, self.next_slot) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
 
-        # LLM models
-        for model in models.get("llm", []):
+async def run_evaluation(models: Dict[str, List[str]], checkpoint_path, workers: int = 8,
+                         model_concurrency: int = 4, model_rpm: float = 0, image_profile: str = None) -> Dict[tuple, dict]:
+    """
+    Run every (file, method, model) combination concurrently, appending each result to the
+    checkpoint as soon as it finishes. Combinations already in the checkpoint are skipped.
+    """
+    from app.services.document import Document
+    from app.services.llm_extraction import llm_extract_async
+    from app.services.ocr_service import ocr_and_structure_async
+    from app.services.routing import AUTO_MODEL, cascade
+
+    done = load_checkpoint(checkpoint_path)
+    files = sorted(f for f in IMAGE_DIR.iterdir()
+                   if f.suffix.lower() in [".jpg", ".jpeg", ".png", ".pdf"] and f.name in GROUND_TRUTH)
+    tasks = [(f, method, model) for f in files for method in ("ocr", "llm", "rules")
+             for model in models.get(method, [])
+             if checkpoint_key(f.name, method, model, image_profile) not in done]
+    print(f"{len(done)} results in checkpoint, {len(tasks)} to run")
+
+    slots = asyncio.Semaphore(workers)
+    limiters = {}
+    write_lock = asyncio.Lock()
+    docs = {}
+    failed = []
+
+    async def run_one(img_file: Path, method: str, model: str):
+        if model not in limiters:
+            limiters[model] = RateLimiter(model_concurrency, model_rpm)
+        if img_file not in docs:
+            docs[img_file] = Document.from_path(str(img_file))
+
+        async with slots, limiters[model]:
             start_time = time.time()
-            llm_pred, usage = llm_extract(str(img_file), model=model)  # usage dict from API
+            if method == "ocr":
+                extract = lambda m: ocr_and_structure_async(docs[img_file], model=m)
+            elif method == "rules":
+                extract = lambda m: ocr_and_structure_async(docs[img_file], model=m, rules=True)
+            else:
+                extract = lambda m: llm_extract_async(docs[img_file], model=m, image_profile=image_profile)
+            try:
+                if model == AUTO_MODEL:
+                    pred, usage = await cascade(extract, method)
+                else:
+                    pred, usage = await extract(model)
+            except Exception as e:
+                # One bad document or model must not abort the rest of the run
+                pred, usage = {"error": f"{type(e).__name__}: {e}"}, {}
             elapsed = time.time() - start_time
 
-            correct, total = compare_dicts(llm_pred, truth)
-            accuracy = correct / total * 100 if total else 0
-
-            tokens_prompt = usage.get("prompt_tokens", 0)
-            tokens_completion = usage.get("completion_tokens", 0)
-            price = calculate_price(model, tokens_prompt, tokens_completion)
-
-            report_rows.append({
-                "file": img_file.name,
-                "method": "llm",
-                "model": model,
-                "accuracy": accuracy,
-                "correct": correct,
-                "total": total,
-                "time_sec": elapsed,
-                "prompt_tokens": tokens_prompt,
-                "completion_tokens": tokens_completion,
-                "total_tokens": tokens_prompt + tokens_completion,
-                "price_usd": price
-            })
-
-    # Save report
+        if "error" in pred:
+            # Left out of the checkpoint so the next run retries it
+            failed.append((img_file.name, method, model))
+            print(f"{method.upper()} ({model}) failed for {img_file.name}: {pred['error']}")
+            return
+        record = {"file": img_file.name, "method": method, "model": model, "image_profile": image_profile,
+                  "prediction": pred, "usage": usage, "time_sec": elapsed}
+        async with write_lock:
+            with open(checkpoint_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        done[checkpoint_key(img_file.name, method, model, image_profile)] = record
+        print(f"Processed {img_file.name} {method} {model} in {elapsed:.1f}s")
+
+    try:
+        await asyncio.gather(*(run_one(*task) for task in tasks))
+        if failed:
+            print(f"{len(failed)} of {len(tasks)} runs failed; rerun to retry them:")
+            for name, method, model in sorted(failed):
+                print(f"  {name} {method} {model}")
+    finally:
+        from app.services import openrouter, ocr_pool
+        await openrouter.aclose()
+        ocr_pool.shutdown()
+    return done
+
+
+def write_report(records, report_path) -> List[dict]:
+    report_rows = [score_record(r) for r in records if r["file"] in GROUND_TRUTH]
+    report_rows.sort(key=lambda r: (r["file"], r["method"], r["model"], r["image_profile"] or ""))
+    if not report_rows:
+        print("No results to report.")
+        return report_rows
+
     with open(report_path, "w", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=report_rows[0].keys())
         writer.writeheader()
@@ -383,9 +456,43 @@ def test_pipeline(models: Dict[str, List[str]], report_path, mode: str = "boolea
     print(f"\nReport saved to {report_path}")
     return report_rows
 
+
+def test_pipeline(models: Dict[str, List[str]], report_path, mode: str = "boolean", image_profile: str = None,
+                  checkpoint_path="model_eval_checkpoint.jsonl", workers: int = 8, model_concurrency: int = 4,
+                  model_rpm: float = 0, replay: bool = False):
+    """
+    Evaluate models against GROUND_TRUTH and write a CSV report.
+    With replay=True, re-score the checkpointed outputs offline without any API calls.
+    """
+    if replay:
+        records = load_checkpoint(checkpoint_path)
+    else:
+        records = asyncio.run(run_evaluation(models, checkpoint_path, workers=workers,
+                                             model_concurrency=model_concurrency, model_rpm=model_rpm,
+                                             image_profile=image_profile))
+    return write_report(records.values(), report_path)
+
 if __name__ == "__main__":
-    models_to_test = {"ocr": TOKEN_PRICES.keys(), "llm": TOKEN_PRICES.keys()}
-    report_rows = test_pipeline(models=models_to_test, report_path="model_eval_report.csv")
+    parser = argparse.ArgumentParser(description="Evaluate extraction models against GROUND_TRUTH.")
+    parser.add_argument("--models", nargs="+", default=list(TOKEN_PRICES.keys()),
+                        help='models to evaluate; "auto" runs the cheap-first model cascade')
+    parser.add_argument("--methods", nargs="+", default=["ocr", "llm"], choices=["ocr", "llm", "rules"])
+    parser.add_argument("--workers", type=int, default=8, help="calls in flight across all models")
+    parser.add_argument("--model-concurrency", type=int, default=4, help="calls in flight per model")
+    parser.add_argument("--model-rpm", type=float, default=0, help="max calls per minute per model (0: no limit)")
+    parser.add_argument("--image-profile", default=None)
+    parser.add_argument("--checkpoint", default="model_eval_checkpoint.jsonl")
+    parser.add_argument("--report", default="model_eval_report.csv")
+    parser.add_argument("--replay", action="store_true", help="re-score checkpointed outputs without API calls")
+    args = parser.parse_args()
+
+    models_to_test = {method: args.models for method in args.methods}
+    report_rows = test_pipeline(models=models_to_test, report_path=args.report, image_profile=args.image_profile,
+                                checkpoint_path=args.checkpoint, workers=args.workers,
+                                model_concurrency=args.model_concurrency, model_rpm=args.model_rpm,
+                                replay=args.replay)
+
+    import pandas as pd
 
     df_report = pd.DataFrame(report_rows)  # convert list of dicts to DataFrame
 